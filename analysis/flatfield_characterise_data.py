@@ -45,7 +45,7 @@ print("Loaded data")
 mean_bias_corrected = camera.correct_bias(mean_raw)
 
 # Normalise the RGBG2 channels to a maximum of 1 each
-mean_normalised, stds_normalised = flat.normalise_RGBG2(mean_bias_corrected, stds_raw, camera.bayer_map)
+mean_normalised, stds_normalised = flat.normalise_RGBG2(mean_bias_corrected, stds_raw, camera.bayer_tile)
 print("Normalised data")
 
 # Calculate the signal-to-noise ratio (SNR) per pixel
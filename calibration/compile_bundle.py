@@ -0,0 +1,27 @@
+"""
+Compile all calibration data for the camera in the `root` folder into a single
+calibration bundle. The bundle contains every calibration product (bias map,
+read noise, dark current, ISO look-up table, gain map, flat-field map,
+spectral response, spectral bands, and RGB -> XYZ matrix), with the flat-field
+model already evaluated. `Camera.load_all_calibrations` memory-maps the bundle
+instead of loading the separate files, as long as it is newer than all of
+them. Run this script again after updating any calibration.
+
+Command line arguments:
+    * `folder`: folder containing camera data.
+"""
+from spectacle import load_camera, io
+from sys import argv
+
+# Get the data folder from the command line
+folder = io.path_from_input(argv)
+root = io.find_root_folder(folder)
+
+# Load Camera object
+camera = load_camera(root)
+print(f"Loaded Camera object: {camera}")
+
+# Load all calibration data and write them to the bundle
+save_to = camera.write_calibration_bundle()
+print(f"Saved calibration bundle to '{save_to}'")
+print(f"Calibration data in bundle: {camera.check_calibration_data()}")
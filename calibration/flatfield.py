@@ -48,7 +48,7 @@ print("Loaded data")
 mean = camera.correct_bias(mean)
 
 # Normalise the RGBG2 channels to a maximum of 1 each
-mean_normalised, stds_normalised = flat.normalise_RGBG2(mean, stds, camera.bayer_map)
+mean_normalised, stds_normalised = flat.normalise_RGBG2(mean, stds, camera.bayer_tile)
 print("Normalised data")
 
 # Convolve the flat-field data with a Gaussian kernel to remove small-scale variations
@@ -73,7 +73,7 @@ plt.show()
 coefficients = wavelength.load_coefficients(root/"intermediaries/spectral_response/ispex_wavelength_solution.npy")
 
 # Load the data
-img  = io.load_raw_file(file)
+img  = io.load_raw_data(file, colors=True)
 print("Loaded data")
 
 # Bias correction
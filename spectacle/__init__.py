@@ -1,4 +1,4 @@
 from . import analyse, calibrate, io
-from .io import load_raw_file, load_raw_image, load_raw_image_multi, load_exif, load_means, load_stds
+from .io import load_raw_file, load_raw_data, load_raw_image, load_raw_image_multi, load_exif, load_means, load_stds
 from .general import gauss_filter, weighted_mean, Rsquare, RMS, symmetric_percentiles
 from .camera import Camera, load_camera
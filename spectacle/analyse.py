@@ -44,6 +44,74 @@ def statistics(data, prefix_column=None, prefix_column_header=""):
     return table
 
 
+def reduce_RGBG2(data, bayer_data, function=np.mean, **kwargs):
+    """
+    Apply a reduction `function` (default: mean) to each RGBG2 channel in
+    mosaicked `data` of shape (..., H, W), according to the `bayer_data`
+    (Bayer map, Bayer tile, or CFA plan). Returns an array of shape (..., 4).
+
+    The channels are accessed through strided views, so the data are not
+    demosaicked into a copy first.
+    Any additional **kwargs are passed to `function`.
+    """
+    return raw.cfa_plan(bayer_data).reduce(data, function, **kwargs)
+
+
+def mean_RGBG2(data, bayer_data, **kwargs):
+    """
+    Mean value per RGBG2 channel, with shape (..., 4). See `reduce_RGBG2`.
+    """
+    return reduce_RGBG2(data, bayer_data, np.mean, **kwargs)
+
+
+def std_RGBG2(data, bayer_data, **kwargs):
+    """
+    Standard deviation per RGBG2 channel, with shape (..., 4). See
+    `reduce_RGBG2`.
+    """
+    return reduce_RGBG2(data, bayer_data, np.std, **kwargs)
+
+
+def min_RGBG2(data, bayer_data, **kwargs):
+    """
+    Minimum value per RGBG2 channel, with shape (..., 4). See `reduce_RGBG2`.
+    """
+    return reduce_RGBG2(data, bayer_data, np.min, **kwargs)
+
+
+def max_RGBG2(data, bayer_data, **kwargs):
+    """
+    Maximum value per RGBG2 channel, with shape (..., 4). See `reduce_RGBG2`.
+    """
+    return reduce_RGBG2(data, bayer_data, np.max, **kwargs)
+
+
+def percentile_RGBG2(data, bayer_data, q, **kwargs):
+    """
+    Percentile(s) `q` per RGBG2 channel, with shape (..., 4), or (Q, ..., 4)
+    for multiple percentiles. See `reduce_RGBG2`.
+    """
+    return reduce_RGBG2(data, bayer_data, np.percentile, q=q, **kwargs)
+
+
+def histogram_RGBG2(data, bayer_data, bins=500, range=None, **kwargs):
+    """
+    Histogram per RGBG2 channel of mosaicked `data` of shape (..., H, W),
+    according to the `bayer_data` (Bayer map, Bayer tile, or CFA plan).
+    All channels use the same bins, which are determined from all data if
+    they are not given explicitly. NaN values are ignored.
+
+    Returns the counts with shape (4, nrbins) and the bin edges.
+    Any additional **kwargs are passed to `np.histogram`.
+    """
+    plan = raw.cfa_plan(bayer_data)
+    if range is None and np.ndim(bins) == 0:
+        range = (np.nanmin(data), np.nanmax(data))
+    bins = np.histogram_bin_edges(data, bins=bins, range=range)
+    counts = np.array([sum(np.histogram(data[s], bins=bins, **kwargs)[0] for s in slices) for slices in plan.slices])
+    return counts, bins
+
+
 def plot_gauss_maps(data, bayer_data, kernel_width_RGBG2=5, **kwargs):
     """
     Plot maps of the `data`, convolved with a Gaussian kernel. Both the
@@ -63,31 +131,39 @@ def plot_gauss_maps(data, bayer_data, kernel_width_RGBG2=5, **kwargs):
         # Use the faster gaussMd function if NaN values are not present
         gauss_function = gaussMd
 
-    # Demosaick data by splitting the RGBG2 channels into separate arrays
-    data_RGBG2 = raw.demosaick(bayer_data, data)
+    # Split the RGBG2 channels into strided views, without copying
+    data_RGBG2 = raw.demosaick(bayer_data, data, views=True)
 
     # Convolve the data with a Gaussian kernel
     # The two-dimensional mosaicked data are convolved over both axes
-    # The three-dimensional demosaicked RGBG2 data are convolved over the two
-    # spatial axes (1, 2), not the colour axis (0)
+    # Each RGBG2 channel is convolved separately over its two spatial axes
     kernel_width_mosaic = 2 * kernel_width_RGBG2
     data_gaussed = gauss_function(data, kernel_width_mosaic)
-    data_RGBG2_gaussed = gauss_function(data_RGBG2, (0, kernel_width_RGBG2, kernel_width_RGBG2))
+    data_RGBG2_gaussed = np.stack([gauss_function(channel, kernel_width_RGBG2) for channel in data_RGBG2])
 
     plot.show_image(data_gaussed, **kwargs)
     plot.show_image_RGBG2(data_RGBG2_gaussed, **kwargs)
 
 
-def plot_histogram_RGB(data, bayer_data, **kwargs):
+def plot_histogram_RGB(data, bayer_data, xmin="auto", xmax="auto", nrbins=500, **kwargs):
     """
-    Plot an RGB histogram of the `data`, demosaicked according to the
-    `bayer_data`.
+    Plot an RGB histogram of the `data`, split into channels according to the
+    `bayer_data`, between `xmin` and `xmax` (default: the 0.1 and 99.9
+    percentiles) in `nrbins` bins.
 
-    Any additional **kwargs are passed to `plot.histogram_RGB`.
+    The histograms are calculated per channel using `histogram_RGBG2`, so the
+    data are not demosaicked into a copy first.
+    Any additional **kwargs are passed to `plot.histogram_RGB_counts`.
     """
+    # Determine the range of the histogram from all data
+    if xmin == "auto":
+        xmin = symmetric_percentiles(data)[0]
+    if xmax == "auto":
+        xmax = symmetric_percentiles(data)[1]
+    bins = np.linspace(xmin, xmax, nrbins)
 
-    # Demosaick data by splitting the RGBG2 channels into separate arrays
-    data_RGBG2 = raw.demosaick(bayer_data, data)
+    # Calculate the histogram per RGBG2 channel
+    counts, bins = histogram_RGBG2(data, bayer_data, bins=bins)
 
     # Plot the RGB histogram
-    plot.histogram_RGB(data_RGBG2, **kwargs)
+    plot.histogram_RGB_counts(counts, bins, **kwargs)
@@ -0,0 +1,254 @@
+"""
+Code relating to caching, such as keeping decoded RAW images on disk so they
+do not need to be decoded again, or keeping combined calibration maps in
+memory.
+"""
+
+import numpy as np
+import os
+from collections import OrderedDict
+from hashlib import sha1
+from pathlib import Path
+from uuid import uuid4
+
+
+class FrameCache(object):
+    """
+    Persistent on-disk cache of decoded images, stored as NPY files that are
+    loaded as read-only memory maps.
+
+    Entries are keyed by the absolute path, size, and modification time of
+    the original file, so a changed file is automatically decoded again.
+    When the total size of the cache exceeds `max_size` (in MB), the least
+    recently used entries are removed.
+    """
+    def __init__(self, folder, max_size=10240):
+        """
+        Create a frame cache in `folder`, with a maximum size of `max_size`
+        MB (default: 10 GB).
+        """
+        self.folder = Path(folder)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        # Make sure the cache folder exists
+        os.makedirs(self.folder, exist_ok=True)
+
+    def __repr__(self):
+        """
+        Text representation of the FrameCache object
+        """
+        return f"FrameCache in `{self.folder}` ({self.size()/1024**2:.0f}/{self.max_size:.0f} MB, {self.hits} hits, {self.misses} misses)"
+
+    def _filename(self, filename):
+        """
+        Generate the cache filename for an original file `filename`, based on
+        its absolute path, size, and modification time.
+        """
+        filename = Path(filename).absolute()
+        stat = filename.stat()
+        key = sha1(f"{filename}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+        return self.folder/f"{key}.npy"
+
+    def get(self, filename):
+        """
+        Retrieve the cached image for an original file `filename` as a
+        read-only memory map. Returns None if it is not in the cache.
+        """
+        cache_filename = self._filename(filename)
+
+        # The entry may be evicted by another process at any point, in which
+        # case it is treated as not being in the cache
+        try:
+            data = np.load(cache_filename, mmap_mode="r")
+
+            # Update the access time, which is used for least-recently-used eviction
+            os.utime(cache_filename)
+        except FileNotFoundError:
+            return None
+
+        return data
+
+    def put(self, filename, data):
+        """
+        Store an image `data` decoded from an original file `filename`, then
+        remove old entries if the cache is too large.
+        """
+        cache_filename = self._filename(filename)
+
+        # Write to a temporary file first, so other threads or processes never
+        # see an incomplete file
+        temporary_filename = cache_filename.with_suffix(f".{uuid4().hex}.tmp")
+        with open(temporary_filename, "wb") as file:
+            np.save(file, data)
+        os.replace(temporary_filename, cache_filename)
+
+        self.evict()
+
+    def load(self, filename, load_function):
+        """
+        Load the image in `filename` from the cache if available. Otherwise,
+        decode it using `load_function` and store the result in the cache.
+        Cached images are returned as read-only memory maps.
+        """
+        data = self.get(filename)
+        if data is None:
+            self.misses += 1
+            data = load_function(filename)
+            self.put(filename, data)
+        else:
+            self.hits += 1
+
+        return data
+
+    def _entries(self):
+        """
+        List the entries in the cache, with their sizes (in bytes) and last
+        access times, from least to most recently used. Entries that are
+        removed by another process while listing are skipped.
+        """
+        entries = []
+        for entry in os.scandir(self.folder):
+            if not entry.name.endswith(".npy"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:  # Removed by another process
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        entries = sorted(entries)
+        return entries
+
+    def size(self):
+        """
+        Total size of the cache in bytes.
+        """
+        return sum(size for time, size, path in self._entries())
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the total size of the
+        cache is below `max_size`.
+        """
+        entries = self._entries()
+        total = sum(size for time, size, path in entries)
+        for time, size, path in entries:
+            if total <= self.max_size * 1024**2:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # Already removed by another process
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        for time, size, path in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # Already removed by another process
+                pass
+
+
+class MapCache(object):
+    """
+    In-memory cache of arrays (or tuples of arrays), such as combined
+    calibration maps, keyed by any hashable key.
+
+    When the total size of the cache exceeds `max_size` (in MB), the least
+    recently used entries are removed.
+    """
+    def __init__(self, max_size=1024):
+        """
+        Create a map cache with a maximum size of `max_size` MB (default:
+        1 GB).
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __repr__(self):
+        """
+        Text representation of the MapCache object
+        """
+        return f"MapCache ({len(self._entries)} entries, {self.size()/1024**2:.0f}/{self.max_size:.0f} MB, {self.hits} hits, {self.misses} misses)"
+
+    def __len__(self):
+        """
+        Number of entries in the cache.
+        """
+        return len(self._entries)
+
+    @staticmethod
+    def _nbytes(value):
+        """
+        Size in bytes of an array or tuple of arrays `value`. Elements that
+        are not arrays, such as metadata, are not counted.
+        """
+        if isinstance(value, tuple):
+            return sum(getattr(element, "nbytes", 0) for element in value)
+        return getattr(value, "nbytes", 0)
+
+    def get(self, key):
+        """
+        Retrieve the entry for `key`, or None if it is not in the cache.
+        """
+        try:
+            value = self._entries[key]
+        except KeyError:
+            return None
+
+        # Mark this entry as the most recently used
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """
+        Store `value` under `key`, then remove old entries if the cache is too
+        large. Entries larger than the cache itself are not stored.
+        """
+        if self._nbytes(value) <= self.max_size * 1024**2:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self.evict()
+
+    def load(self, key, function, *args, **kwargs):
+        """
+        Retrieve the entry for `key` if available. Otherwise, calculate it
+        using `function(*args, **kwargs)` and store the result in the cache.
+        """
+        value = self.get(key)
+        if value is None:
+            self.misses += 1
+            value = function(*args, **kwargs)
+            self.put(key, value)
+        else:
+            self.hits += 1
+
+        return value
+
+    def size(self):
+        """
+        Total size of the cache in bytes.
+        """
+        return sum(self._nbytes(value) for value in self._entries.values())
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the total size of the
+        cache is below `max_size`.
+        """
+        total = self.size()
+        while total > self.max_size * 1024**2 and len(self._entries) > 0:
+            key, value = self._entries.popitem(last=False)
+            total -= self._nbytes(value)
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        self._entries.clear()
@@ -3,10 +3,18 @@ Module for calibrating camera data based on calibration data.
 
 If you are only interested in calibrating your data, using previously generated
 calibrations, this is the module to use.
+
+Calibration data are loaded once and then kept in a process-wide cache, keyed
+by root folder. If a calibration file changes (different modification time or
+size), its data are loaded again automatically. Use `clear_cache` to empty the
+cache manually.
 """
 
+from pathlib import Path
+
 # Import other SPECTACLE submodules to use in functions
 from . import bias_readnoise, dark, flat, gain, io, iso, spectral
+from .cache import MapCache
 
 # Import functions from other SPECTACLE submodules which may be used in
 # calibration scripts, for simpler access
@@ -19,22 +27,140 @@ from .camera import load_camera
 from .raw import demosaick
 from .spectral import load_spectral_response, load_spectral_bands, convert_RGBG2_to_RGB
 
+# Process-wide cache of calibration data, with a maximum size in MB
+calibration_cache = MapCache(max_size=4096)
 
-def correct_bias(root, *data):
+
+# Files that each type of calibration data may be loaded from, as (subfolder
+# of the root folder, filename) pairs, matched like `io.find_matching_file`
+_calibration_files = {"bias": [("calibration", "bias.npy"), (".", "data.json")],
+                      "dark_current": [("calibration", "dark_current_normalised.npy")],
+                      "iso_lookup_table": [("calibration", "iso_normalisation_lookup_table.csv")],
+                      "gain_map": [("calibration", "gain.npy")],
+                      "flatfield": [("calibration", "flatfield_parameters.csv"), (".", "data.json")],
+                      "spectral_response": [("calibration", "spectral_response.csv")]}
+
+
+def _file_stamps(root, data_type):
     """
-    Perform a bias correction on data using a bias map from
-    `root`/calibration/
+    Modification time and size of the files that calibration data of a given
+    `data_type` may be loaded from (see `_calibration_files`), used to check
+    whether cached data are still up to date. Files that do not exist (yet)
+    are included as an empty match, so creating them later is also noticed.
+    Returns None if a file disappears while checking.
+    """
+    stamps = []
+    try:
+        for folder, filename in _calibration_files[data_type]:
+            files = sorted((Path(root)/folder).glob(f"*{filename}"))
+            stamps.append(tuple((str(file), file.stat().st_mtime_ns, file.stat().st_size) for file in files))
+    except OSError:
+        return None
+    return tuple(stamps)
 
-    To do:
-        - ISO selection
+
+def _load_cached(root, data_type, load_function):
+    """
+    Load calibration data of a given `data_type` for `root` from the cache,
+    if they are available and their files have not changed since.
+    Otherwise, load them using `load_function(root)`, which returns the data
+    and a message to print, and store them in the cache.
+    """
+    key = (Path(root).absolute(), data_type)
+
+    # Use the cached data if their files have not changed and no new files
+    # have appeared
+    stamps = _file_stamps(root, data_type)
+    entry = calibration_cache.get(key)
+    if entry is not None and stamps is not None and entry[1] == stamps:
+        calibration_cache.hits += 1
+        return entry[0]
+
+    # Otherwise, load the data and store them in the cache
+    calibration_cache.misses += 1
+    data, message = load_function(root)
+    print(message)
+    if hasattr(data, "flags"):
+        data.flags.writeable = False
+    calibration_cache.put(key, (data, stamps))
+
+    return data
+
+
+def clear_cache():
+    """
+    Remove all calibration data from the process-wide cache.
+    """
+    calibration_cache.clear()
+
+
+def _load_bias(root):
+    """
+    Load a bias map, or a bias map generated from the camera information if
+    there is none. Helper function for `_load_cached`.
     """
     try:
         bias, origin = bias_readnoise.load_bias_map(root, return_filename=True)
     except FileNotFoundError:
         bias, origin = bias_readnoise.load_bias_metadata(root, return_filename=True)
-        print(f"Using bias value from metadata in '{origin}'")
+        message = f"Using bias value from metadata in '{origin}'"
     else:
-        print(f"Using bias map from '{origin}'")
+        message = f"Using bias map from '{origin}'"
+    return bias, message
+
+
+def _load_dark_current(root):
+    """
+    Load a dark current map. Helper function for `_load_cached`.
+    """
+    dark_current, origin = dark.load_dark_current_map(root, return_filename=True)
+    return dark_current, f"Using dark current map from '{origin}'"
+
+
+def _load_iso_lookup_table(root):
+    """
+    Load an ISO normalisation look-up table. Helper function for
+    `_load_cached`.
+    """
+    lookup_table, origin = iso.load_iso_lookup_table(root, return_filename=True)
+    return lookup_table, f"Using ISO speed normalisation look-up table from '{origin}'"
+
+
+def _load_gain_map(root):
+    """
+    Load a normalised gain map. Helper function for `_load_cached`.
+    """
+    gain_map, origin = gain.load_gain_map(root, return_filename=True)  # norm. ADU / e-
+    return gain_map, f"Using normalised gain map from '{origin}'"
+
+
+def _load_flatfield(root):
+    """
+    Load the flat-field model and evaluate it at the camera's image shape,
+    taken from the camera information. Helper function for `_load_cached`.
+    """
+    camera = load_camera(root)
+    correction_map, origin = flat.load_flatfield_correction(root, shape=camera.image_shape, return_filename=True)
+    return correction_map, f"Using flat-field map from '{origin}'"
+
+
+def _load_spectral_response(root):
+    """
+    Load spectral response curves. Helper function for `_load_cached`.
+    """
+    spectral_response, origin = spectral.load_spectral_response(root, return_filename=True)
+    return spectral_response, f"Using spectral response curves from '{origin}'"
+
+
+def correct_bias(root, *data):
+    """
+    Perform a bias correction on data using a bias map from
+    `root`/calibration/
+
+    To do:
+        - ISO selection
+    """
+    bias = _load_cached(root, "bias", _load_bias)
 
     # Correct each given array
     data_corrected = bias_readnoise.correct_bias_from_map(bias, *data)
@@ -51,8 +177,7 @@ def correct_dark_current(root, exposure_time, *data):
         - Easy way to parse exposure times in scripts
     """
     # Load dark current map
-    dark_current, origin = dark.load_dark_current_map(root, return_filename=True)
-    print(f"Using dark current map from '{origin}'")
+    dark_current = _load_cached(root, "dark_current", _load_dark_current)
 
     # Correct each given array
     data_corrected = dark.correct_dark_current_from_map(dark_current, exposure_time, *data)
@@ -68,8 +193,7 @@ def normalise_iso(root, iso_values, *data):
     `iso_values` can be a single number (for a single ISO value) or a list-like object
     (for multiple)
     """
-    lookup_table, origin = iso.load_iso_lookup_table(root, return_filename=True)
-    print(f"Using ISO speed normalisation look-up table from '{origin}'")
+    lookup_table = _load_cached(root, "iso_lookup_table", _load_iso_lookup_table)
 
     # Correct each given array
     data_corrected = iso.normalise_iso_general(lookup_table, iso_values, *data)
@@ -83,8 +207,7 @@ def convert_to_photoelectrons(root, *data):
     (in normalised ADU per photoelectron) from `root`/calibration/
     """
     # Load the gain map
-    gain_map, origin = gain.load_gain_map(root, return_filename=True)  # norm. ADU / e-
-    print(f"Using normalised gain map from '{origin}'")
+    gain_map = _load_cached(root, "gain_map", _load_gain_map)  # norm. ADU / e-
 
     # Correct each given array
     data_converted = gain.convert_to_photoelectrons_from_map(gain_map, *data)
@@ -97,12 +220,8 @@ def correct_flatfield(root, *data, **kwargs):
     Correction for flat-fielding using a flat-field correction map read from
     `root`/calibration/
     """
-    # Load Camera object to get the array shape
-    camera = load_camera(root)
-
-    # Load the correction map
-    correction_map, origin = flat.load_flatfield_correction(root, shape=camera.image_shape, return_filename=True)
-    print(f"Using flat-field map from '{origin}'")
+    # Load the correction map, evaluated at the camera's image shape
+    correction_map = _load_cached(root, "flatfield", _load_flatfield)
 
     # Correct each given array
     data_corrected = flat.correct_flatfield_from_map(correction_map, *data, **kwargs)
@@ -123,8 +242,7 @@ def correct_spectral_response(root, data_wavelengths, *data):
     for every wavelength. If not, an error is thrown.
     """
     # Load the spectral response curves
-    spectral_response, origin = spectral.load_spectral_response(root, return_filename=True)
-    print(f"Using spectral response curves from '{origin}'")
+    spectral_response = _load_cached(root, "spectral_response", _load_spectral_response)
 
     # Normalise the input data by the spectral response and return the result
     data_normalised = spectral.correct_spectra(spectral_response, data_wavelengths, *data)
@@ -6,12 +6,19 @@ The Camera object also provides an easy interface for data calibration/correctio
 
 import numpy as np
 import json
+import mmap
 from collections import namedtuple
 from pathlib import Path
 from os import makedirs
 
-from . import raw, analyse, bias_readnoise, dark, iso, gain, flat, spectral
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+from . import raw, analyse, bias_readnoise, dark, iso, gain, flat, spectral, io
 from .general import return_with_filename, find_matching_file
+from .cache import MapCache
 
 
 def find_root_folder(input_path):
@@ -65,6 +72,41 @@ def makedirs_without_file(path):
     makedirs(path_for_makedirs, exist_ok=True)
 
 
+# Reference to a calibration array stored outside of a Camera object, either
+# in named shared memory (`kind` "shared", `name` of the memory block) or in a
+# file (`kind` "memmap", `name` of the file, with a byte `offset`)
+_SharedArray = namedtuple("_SharedArray", ["kind", "name", "offset", "shape", "dtype", "order"])
+
+# Camera settings (ISO speed and exposure time range), see `Camera.load_settings`
+# Defined at module level so Camera objects with settings can be pickled
+Settings = namedtuple("Settings", ["ISO_min", "ISO_max", "exposure_min", "exposure_max"])
+
+
+def _reference_array(array, shared_memory_blocks, name):
+    """
+    Generate a reference to `array` if it is stored in shared memory (one of
+    the `shared_memory_blocks`, by attribute `name`) or memory-mapped from a
+    file. Returns None if it is neither.
+    """
+    if name in shared_memory_blocks:
+        return _SharedArray("shared", shared_memory_blocks[name].name, 0, array.shape, array.dtype.str, "C")
+    elif isinstance(array, np.memmap) and isinstance(array.base, mmap.mmap):
+        order = "F" if array.flags.f_contiguous and not array.flags.c_contiguous else "C"
+        return _SharedArray("memmap", array.filename, array.offset, array.shape, array.dtype.str, order)
+    else:
+        return None
+
+
+def _per_frame(values, dtype):
+    """
+    Convert a scalar or an array of `values` with one value per frame (e.g.
+    ISO speed or exposure time) to `dtype`, such that an array broadcasts
+    against a stack of frames of shape (N, X, Y).
+    """
+    values = np.asarray(values, dtype=dtype)
+    return values.reshape(values.shape + (1, 1)) if values.ndim else values[()]
+
+
 def _convert_exposure_time(exposure):
     """
     Convert an exposure time, in various formats, into a floating-point number.
@@ -108,10 +150,23 @@ class Camera(object):
     """
     # Properties a Camera can have
     property_list = ["name", "manufacturer", "name_internal", "image_shape", "raw_extension", "bias", "bayer_pattern", "bit_depth", "colour_description"]
-    Settings = namedtuple("Settings", ["ISO_min", "ISO_max", "exposure_min", "exposure_max"])
+    Settings = Settings
 
     calibration_data_all = ["settings", "bias_map", "readnoise", "dark_current", "iso_lookup_table", "gain_map", "flatfield_map", "spectral_response", "spectral_bands", "XYZ_matrix"]
 
+    # Calibration steps that can be applied at once using `calibrate`, in order
+    calibration_steps = ["bias", "dark", "iso", "gain", "flatfield"]
+
+    # Maximum size (in MB) of the cache of combined calibration maps
+    correction_cache_size = 1024
+
+    # Calibration data that can be shared between processes without copying
+    calibration_arrays = ["bias_map", "readnoise", "dark_current", "iso_lookup_table", "gain_map", "flatfield_map"]
+
+    # Calibration data stored in a calibration bundle, see `write_calibration_bundle`
+    bundle_arrays = calibration_arrays + ["spectral_response", "spectral_bands", "XYZ_matrix"]
+    bundle_suffix = "calibration_bundle.spectacle"
+
     def __init__(self, name, manufacturer, name_internal, image_shape, raw_extension, bias, bayer_pattern, bit_depth, colour_description="RGBG", root=None):
         """
         Generate a Camera object based on input dictionaries containing the
@@ -132,8 +187,15 @@ class Camera(object):
         self.colour_description = colour_description
         self.root = root
 
+        # Shared memory blocks holding calibration data, see `share_calibrations`
+        self._shared_memory = {}
+
+        # Cache of combined calibration maps per set of capture settings, see `calibrate`
+        self.correction_cache = MapCache(max_size=self.correction_cache_size)
+
         # Generate/calculate commonly used values/properties
-        self.bayer_map = self._generate_bayer_map()
+        self.bayer_tile = raw.bayer_tile(self.bayer_pattern)
+        self.cfa = raw.cfa_plan(self.bayer_tile)
         self.saturation = 2**self.bit_depth - 1
         self.bands = self.colour_description
 
@@ -169,6 +231,93 @@ class Camera(object):
         text = combiner.join([device_name, manufacturer, internal_name, source, calibration_list])
         return text
 
+    def __getstate__(self):
+        """
+        State of the Camera object for pickling, e.g. when sending it to a
+        multiprocessing worker. Calibration arrays that are in shared memory
+        (see `share_calibrations`) or memory-mapped from a file are replaced
+        with small references, so they are not copied. This includes shared
+        memory attached to by an unpickled Camera object, so it can be passed
+        on again by reference.
+        """
+        state = self.__dict__.copy()
+        shared_memory_blocks = {**state.pop("_attached_memory", {}), **state.pop("_shared_memory")}
+
+        # The cache of combined calibration maps is not sent along
+        state["correction_cache"] = MapCache(max_size=self.correction_cache.max_size)
+        for name in self.calibration_arrays:
+            array = state.get(name)
+            if isinstance(array, np.ndarray):
+                reference = _reference_array(array, shared_memory_blocks, name)
+                if reference is not None:
+                    state[name] = reference
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restore a pickled Camera object, re-attaching any calibration arrays
+        in shared memory or memory-mapped files. These are read-only.
+        """
+        self.__dict__.update(state)
+
+        # Shared memory attached to in this process is kept open as long as
+        # this object exists, but not owned (or removed) by it
+        self._shared_memory = {}
+        self._attached_memory = {}
+        for name in self.calibration_arrays:
+            reference = state.get(name)
+            if not isinstance(reference, _SharedArray):
+                continue
+            if reference.kind == "shared":
+                block = shared_memory.SharedMemory(name=reference.name)
+                array = np.ndarray(reference.shape, dtype=reference.dtype, buffer=block.buf)
+                array.flags.writeable = False
+                self._attached_memory[name] = block
+            else:
+                array = np.memmap(reference.name, mode="r", dtype=reference.dtype, offset=reference.offset, shape=reference.shape, order=reference.order)
+            setattr(self, name, array)
+
+    def share_calibrations(self):
+        """
+        Copy the calibration arrays that have been loaded so far (bias map,
+        dark current, gain map, etc.) into named shared memory. When the
+        Camera object is then pickled, e.g. to send it to a multiprocessing
+        worker, only the names of the shared memory blocks are sent, and the
+        worker uses the same memory instead of a copy.
+
+        Arrays that are memory-mapped from a file are not copied, since these
+        can already be shared through the file.
+
+        Call `release_shared_memory` when the workers are done.
+        """
+        if shared_memory is None:
+            raise ImportError("Sharing calibration data requires Python 3.8 or newer.")
+
+        for name in self.calibration_arrays:
+            data = getattr(self, name, None)
+            if not isinstance(data, np.ndarray) or _reference_array(data, self._shared_memory, name) is not None:
+                continue
+
+            # Copy the data into a new shared memory block, then use that
+            block = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+            array = np.ndarray(data.shape, dtype=data.dtype, buffer=block.buf)
+            array[...] = data
+            array.flags.writeable = False
+            self._shared_memory[name] = block
+            setattr(self, name, array)
+
+    def release_shared_memory(self):
+        """
+        Copy the calibration arrays in shared memory back into this process
+        and release the shared memory blocks. Workers should no longer be
+        using them.
+        """
+        for name, block in list(self._shared_memory.items()):
+            setattr(self, name, np.array(getattr(self, name)))
+            del self._shared_memory[name]
+            block.close()
+            block.unlink()
+
     def _as_dict(self):
         """
         Generate a dictionary containing the Camera metadata, similar to the
@@ -180,14 +329,21 @@ class Camera(object):
     def _generate_bayer_map(self):
         """
         Generate a Bayer map, with the Bayer channel (RGBG2) for each pixel.
+        The map is read-only and shared between all Camera objects with the
+        same Bayer pattern and image shape.
         """
-        bayer_map = np.zeros(self.image_shape, dtype=int)
-        bayer_map[0::2, 0::2] = self.bayer_pattern[0][0]
-        bayer_map[0::2, 1::2] = self.bayer_pattern[0][1]
-        bayer_map[1::2, 0::2] = self.bayer_pattern[1][0]
-        bayer_map[1::2, 1::2] = self.bayer_pattern[1][1]
+        bayer_map = raw.generate_bayer_map(self.bayer_tile, self.image_shape)
         return bayer_map
 
+    @property
+    def bayer_map(self):
+        """
+        Full-size Bayer map, with the Bayer channel (RGBG2) for each pixel.
+        Functions in `spectacle.raw` also accept the 2x2 `bayer_tile` or the
+        CFA plan `cfa`, which are cheaper to use.
+        """
+        return self._generate_bayer_map()
+
     def load_settings(self):
         """
         Load a settings file
@@ -206,15 +362,16 @@ class Camera(object):
         """
         Generate a Bayer-aware map of bias values from the camera information.
         """
-        bayer_map = self._generate_bayer_map()
-        for j, bias_value in enumerate(self.bias):
-            bayer_map[bayer_map == j] = bias_value
-        return bayer_map
+        bias_map = self.cfa.broadcast(self.bias, self.image_shape)
+        return bias_map
 
     def _load_bias_map(self):
         """
         Load a bias map from the root folder or from the camera information.
         """
+        # Combined calibration maps based on the previous data are no longer valid
+        self.correction_cache.clear()
+
         # First try using a data-based bias map from file
         try:
             bias_map = bias_readnoise.load_bias_map(self.root)
@@ -252,6 +409,9 @@ class Camera(object):
         """
         Load a dark current map from the root folder - if none is available, return 0 everywhere.
         """
+        # Combined calibration maps based on the previous data are no longer valid
+        self.correction_cache.clear()
+
         # Try to use a dark current map from file
         try:
             dark_current = dark.load_dark_current_map(self.root)
@@ -275,6 +435,9 @@ class Camera(object):
         Load an ISO normalisation look-up table from the root folder.
         If none is available, make an estimate from the camera's ISO range.
         """
+        # Combined calibration maps based on the previous data are no longer valid
+        self.correction_cache.clear()
+
         # Try to use a lookup table from file
         try:
             lookup_table = iso.load_iso_lookup_table(self.root)
@@ -297,6 +460,9 @@ class Camera(object):
         """
         Load a gain map from the root folder.
         """
+        # Combined calibration maps based on the previous data are no longer valid
+        self.correction_cache.clear()
+
         # Try to use a gain map from file
         try:
             gain_map = gain.load_gain_map(self.root)
@@ -314,6 +480,9 @@ class Camera(object):
         """
         Load a flatfield correction model from the root folder, and generate a correction map.
         """
+        # Combined calibration maps based on the previous data are no longer valid
+        self.correction_cache.clear()
+
         # Try to use a flatfield model from file
         try:
             correction_map = flat.load_flatfield_correction(self.root, shape=self.image_shape)
@@ -384,10 +553,103 @@ class Camera(object):
         self.XYZ_matrix = XYZ_matrix
         self.RGBG2_to_XYZ_matrix = RGBG2_to_XYZ_matrix
 
-    def load_all_calibrations(self):
+    def filename_calibration_bundle(self):
+        """
+        Filename of the calibration bundle for this camera, see
+        `write_calibration_bundle`.
+        """
+        return self.filename_calibration(self.bundle_suffix, makefolders=False)
+
+    def calibration_bundle_is_up_to_date(self):
+        """
+        Check whether a calibration bundle exists and is newer than all other
+        files in the `calibration` folder and the camera information file in
+        the root folder (which the bias may be derived from).
+        """
+        filename = self.filename_calibration_bundle()
+        try:
+            bundle_time = filename.stat().st_mtime_ns
+            files = [file for file in filename.parent.iterdir() if file != filename] + [find_matching_file(self.root, "data.json")]
+            file_times = [file.stat().st_mtime_ns for file in files]
+        except OSError:
+            return False
+        return all(file_time <= bundle_time for file_time in file_times)
+
+    def write_calibration_bundle(self):
+        """
+        Load all available calibration data for this camera from their
+        separate files, evaluate the flat-field model, and write everything
+        into a single calibration bundle in the `calibration` folder.
+
+        In the bundle, each array is page-aligned, so `load_calibration_bundle`
+        can memory-map it. Returns the filename of the bundle.
+        """
+        self.load_all_calibrations(use_bundle=False)
+
+        # Calibration data that are not available are listed in the metadata
+        arrays = {name: np.asarray(getattr(self, name)) for name in self.bundle_arrays if getattr(self, name) is not None}
+        settings = self.settings._asdict() if hasattr(self, "settings") else None
+        metadata = {"image_shape": [int(s) for s in self.image_shape], "bias_type": self.bias_type, "settings": settings, "missing": [name for name in self.bundle_arrays if name not in arrays]}
+
+        # Write to a temporary file first, so an existing bundle remains
+        # valid until the new one is complete
+        filename = self.filename_calibration_bundle()
+        filename_temporary = filename.with_name(filename.name + ".tmp")
+        maps = io.write_container(filename_temporary, arrays, metadata)
+        for array in maps.values():
+            array.flush()
+        del maps
+        filename_temporary.replace(filename)
+
+        # Use the memory-mapped bundle from now on
+        self.load_calibration_bundle()
+
+        return filename
+
+    def load_calibration_bundle(self):
+        """
+        Load all calibration data for this camera from its calibration bundle
+        (see `write_calibration_bundle`). The arrays are read-only memory maps,
+        so loading is fast and processes on the same machine that load the
+        same bundle share the physical memory.
+        """
+        # Combined calibration maps based on the previous data are no longer valid
+        self.correction_cache.clear()
+
+        filename = self.filename_calibration_bundle()
+        metadata, arrays = io.open_container(filename)
+        if tuple(metadata["image_shape"]) != tuple(self.image_shape):
+            raise ValueError(f"Calibration bundle `{filename}` is for an image shape of {metadata['image_shape']}, not {self.image_shape}.")
+
+        # Calibration data
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        for name in metadata["missing"]:
+            setattr(self, name, None)
+        self.bias_type = metadata["bias_type"]
+        if metadata["settings"] is not None:
+            self.settings = self.Settings(**metadata["settings"])
+
+        # Derived data
+        self.RGBG2_to_XYZ_matrix = None if self.XYZ_matrix is None else spectral.convert_matrix_to_RGBG2(self.XYZ_matrix)
+
+    def load_all_calibrations(self, use_bundle=True):
         """
         Load all available calibration data for this camera.
+
+        If `use_bundle` is True (default) and an up-to-date calibration bundle
+        exists (see `write_calibration_bundle`), the data are memory-mapped
+        from that bundle. Otherwise, they are loaded from their separate
+        files.
         """
+        if use_bundle and self.calibration_bundle_is_up_to_date():
+            try:
+                self.load_calibration_bundle()
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Could not load the calibration bundle for {self.name} ({e}), loading separate files instead.")
+            else:
+                return
+
         for func in [self.load_settings, self._load_bias_map, self._load_dark_current_map, self._load_flatfield_correction, self._load_gain_map, self._load_iso_normalisation, self._load_readnoise_map, self._load_spectral_response, self.load_spectral_bands, self._load_XYZ_matrix]:
             func()
 
@@ -471,6 +733,104 @@ class Camera(object):
         data_corrected = flat.correct_flatfield_from_map(self.flatfield_map, *data, **kwargs)
         return data_corrected
 
+    def _calibration_maps(self, iso_value=None, exposure_time=None, steps=calibration_steps, clip=False, dtype=np.float32):
+        """
+        Combine the calibration `steps` (see `calibrate`) into a single offset
+        and scale, such that calibrated = (data - offset) * scale.
+        The offset and scale are full-frame arrays, or scalars if none of the
+        steps involved use a map.
+        """
+        unknown_steps = set(steps) - set(self.calibration_steps)
+        if unknown_steps:
+            raise ValueError(f"Unknown calibration steps: {unknown_steps}. Available steps are: {self.calibration_steps}")
+
+        dtype = np.dtype(dtype).type
+        offset = dtype(0)
+        scale = dtype(1)
+
+        # Bias and dark current are subtracted
+        if "bias" in steps:
+            if not hasattr(self, "bias_map"):
+                self._load_bias_map()
+            offset = offset + self.bias_map.astype(dtype)
+
+        if "dark" in steps:
+            if exposure_time is None:
+                raise ValueError("An exposure time is needed for the dark current correction.")
+            if not hasattr(self, "dark_current"):
+                self._load_dark_current_map()
+            offset = offset + self.dark_current.astype(dtype) * _per_frame(exposure_time, dtype)
+
+        # ISO normalisation, gain, and flat-field are one combined scale
+        if "iso" in steps:
+            if iso_value is None:
+                raise ValueError("An ISO speed is needed for the ISO normalisation.")
+            if not hasattr(self, "iso_lookup_table"):
+                self._load_iso_normalisation()
+            scale = scale / _per_frame(self.iso_lookup_table[1][iso_value], dtype)
+
+        if "gain" in steps:
+            if not hasattr(self, "gain_map"):
+                self._load_gain_map()
+            assert self.gain_map is not None, "Gain map unavailable"
+            scale = scale / self.gain_map.astype(dtype)
+
+        if "flatfield" in steps:
+            if not hasattr(self, "flatfield_map"):
+                self._load_flatfield_correction()
+            assert self.flatfield_map is not None, "Flatfield map unavailable"
+            flatfield_map = self.flatfield_map.astype(dtype)
+
+            # Clipping the data is done by making the (2D) flat-field map NaN
+            # at the borders, before any per-frame factors are applied
+            if clip:
+                flatfield_map = flat.clip_data(flatfield_map).astype(dtype)
+            scale = scale * flatfield_map
+
+        # The maps may be cached, so they should not be changed
+        for element in (offset, scale):
+            if isinstance(element, np.ndarray):
+                element.flags.writeable = False
+
+        return offset, scale
+
+    def calibrate(self, data, iso=None, exposure_time=None, steps=calibration_steps, clip=False, dtype=np.float32, out=None):
+        """
+        Calibrate `data` in one pass, applying the given calibration `steps`
+        in the same way as the individual methods:
+            * "bias": `correct_bias`
+            * "dark": `correct_dark_current`, using `exposure_time`
+            * "iso": `normalise_iso`, using the ISO speed `iso`
+            * "gain": `convert_to_photoelectrons`
+            * "flatfield": `correct_flatfield`, with `clip`
+        By default, all steps are applied.
+
+        `iso` and `exposure_time` can also be arrays with one value per frame
+        for a stack of frames.
+
+        All steps are first combined into a single per-pixel offset and scale,
+        which are then applied at once, without intermediate full-frame
+        arrays. The calculation is done in `dtype` (default: float32), and the
+        result is written into `out` if given; use `out=data` to calibrate
+        floating-point data in place.
+
+        The combined offset and scale are kept in `correction_cache`, a
+        least-recently-used cache (with a maximum size in MB), for each set
+        of ISO speed, exposure time, and steps. Frames taken with the same
+        settings only need the final subtraction and multiplication. The
+        cache is cleared automatically whenever calibration data are
+        (re)loaded, e.g. by `load_all_calibrations`.
+        """
+        if (iso is None or np.isscalar(iso)) and (exposure_time is None or np.isscalar(exposure_time)):
+            key = (iso, exposure_time, tuple(steps), clip, np.dtype(dtype).str)
+            offset, scale = self.correction_cache.load(key, self._calibration_maps, iso, exposure_time, steps=steps, clip=clip, dtype=dtype)
+        else:
+            offset, scale = self._calibration_maps(iso, exposure_time, steps=steps, clip=clip, dtype=dtype)
+
+        out = np.subtract(data, offset, out=out, dtype=dtype)
+        out *= scale
+        return out
+
     def correct_spectral_response(self, data_wavelengths, *data):
         """
         Correct data for the sensor's spectral response functions.
@@ -525,23 +885,46 @@ class Camera(object):
     def demosaick(self, *data, **kwargs):
         """
         Demosaick data using this camera's Bayer pattern.
+        Data of any dimensionality, e.g. (N, H, W) series, are demosaicked at
+        once into shape (..., 4, H/2, W/2).
+        Any additional **kwargs are passed to `raw.demosaick`, e.g. use
+        `views=True` to get strided views of the RGBG2 channels without copying.
         """
-        RGBG_data = raw.demosaick(self.bayer_map, *data, color_desc=self.bands, **kwargs)
+        RGBG_data = raw.demosaick(self.cfa, *data, color_desc=self.bands, **kwargs)
         return RGBG_data
 
+    def remosaick(self, *data):
+        """
+        Re-mosaick RGBG2 data, of shape (..., 4, H/2, W/2), using this
+        camera's Bayer pattern.
+        """
+        remosaicked_data = raw.remosaick(self.cfa, *data)
+        return remosaicked_data
+
+    def bin_RGB(self, data, **kwargs):
+        """
+        Bin mosaicked data into RGB superpixels of shape (..., H/2, W/2, 3),
+        averaging G and G2, using this camera's Bayer pattern. The result can
+        be converted to XYZ using `convert_to_XYZ` with `axis=-1`.
+        Any additional **kwargs (e.g. `dtype`, `out`) are passed to
+        `raw.bin_RGB`.
+        """
+        RGB_data = raw.bin_RGB(data, self.cfa, color_desc=self.bands, **kwargs)
+        return RGB_data
+
     def plot_gauss_maps(self, data, **kwargs):
         """
         Plot Gaussian maps using analyse.plot_gauss_maps.
         Uses this camera's Bayer pattern.
         """
-        analyse.plot_gauss_maps(data, self.bayer_map, **kwargs)
+        analyse.plot_gauss_maps(data, self.cfa, **kwargs)
 
     def plot_histogram_RGB(self, data, **kwargs):
         """
         Plot an RGB histogram maps using analyse.plot_gauss_maps.
         Uses this camera's Bayer pattern.
         """
-        analyse.plot_histogram_RGB(data, self.bayer_map, **kwargs)
+        analyse.plot_histogram_RGB(data, self.cfa, **kwargs)
 
     def filename_analysis(self, suffix, makefolders=False):
         """
@@ -0,0 +1,265 @@
+"""
+Code for reading uncompressed DNG files directly, without LibRaw.
+
+Many DNG files store their RAW data as uncompressed 16-bit strips or tiles.
+These can be memory-mapped, so a region of interest (ROI) can be read without
+decoding the whole image. Compressed or bit-packed files, and files with a
+linearisation table, are not supported here; use `io.load_raw_image_roi`,
+which falls back to rawpy for these.
+"""
+
+import numpy as np
+import struct
+
+# Size in bytes of each TIFF data type
+_type_sizes = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4, 16: 8}
+
+# NumPy formats of each TIFF data type (without byte order); rationals are
+# read as pairs of integers
+_type_formats = {1: "u1", 2: "S1", 3: "u2", 4: "u4", 5: "u4", 6: "i1", 7: "u1", 8: "i2", 9: "i4", 10: "i4", 11: "f4", 12: "f8", 13: "u4", 16: "u8"}
+
+# TIFF/DNG tags used here
+tags = {"NewSubFileType": 254, "ImageWidth": 256, "ImageLength": 257, "BitsPerSample": 258, "Compression": 259,
+        "PhotometricInterpretation": 262, "StripOffsets": 273, "SamplesPerPixel": 277, "RowsPerStrip": 278,
+        "StripByteCounts": 279, "TileWidth": 322, "TileLength": 323, "TileOffsets": 324, "TileByteCounts": 325,
+        "SubIFDs": 330, "CFARepeatPatternDim": 33421, "CFAPattern": 33422, "DNGVersion": 50706,
+        "LinearizationTable": 50712, "BlackLevel": 50714, "WhiteLevel": 50717}
+
+# PhotometricInterpretation value for colour filter array (mosaicked) data
+_photometric_CFA = 32803
+
+
+def _read_ifd(file, offset, byteorder):
+    """
+    Read the TIFF image file directory (IFD) at `offset` in an open `file`.
+    Returns a dictionary of tag values (as arrays) and the offset of the next
+    IFD (0 if there is none).
+    """
+    file.seek(offset)
+    nr_entries, = struct.unpack(byteorder + "H", file.read(2))
+    entries = file.read(12 * nr_entries)
+    next_offset, = struct.unpack(byteorder + "I", file.read(4))
+
+    ifd = {}
+    for j in range(nr_entries):
+        tag, data_type, count, value = struct.unpack(byteorder + "HHI4s", entries[12*j:12*(j+1)])
+        if data_type not in _type_sizes:
+            continue
+
+        # Values that fit in 4 bytes are stored in the entry itself
+        size = _type_sizes[data_type] * count
+        if size > 4:
+            position = file.tell()
+            file.seek(struct.unpack(byteorder + "I", value)[0])
+            value = file.read(size)
+            file.seek(position)
+
+        number = 2*count if data_type in (5, 10) else count
+        ifd[tag] = np.frombuffer(value[:size], dtype=byteorder + _type_formats[data_type], count=number)
+        if data_type in (5, 10):  # Rationals
+            ifd[tag] = ifd[tag][0::2] / ifd[tag][1::2]
+
+    return ifd, next_offset
+
+
+def _read_all_ifds(file, offset, byteorder):
+    """
+    Read the chain of IFDs starting at `offset`, including any sub-IFDs.
+    """
+    ifds = []
+    visited = set()
+    while offset and offset not in visited:
+        visited.add(offset)
+        ifd, offset = _read_ifd(file, offset, byteorder)
+        ifds.append(ifd)
+        for sub_offset in ifd.get(tags["SubIFDs"], []):
+            ifds.extend(_read_all_ifds(file, int(sub_offset), byteorder))
+    return ifds
+
+
+def _value(ifd, name, default=None):
+    """
+    Get the (first) value of a tag `name` from an `ifd`.
+    """
+    try:
+        return ifd[tags[name]][0].item()
+    except KeyError:
+        return default
+
+
+class DNGFile(object):
+    """
+    Object that represents the RAW (CFA) image data in a DNG file. If these
+    are stored uncompressed with 8 or 16 bits per pixel (`mappable` is True),
+    they are memory-mapped and `read` returns a region of interest without
+    decoding the whole image.
+    """
+    def __init__(self, filename):
+        """
+        Parse the TIFF structure of the DNG file `filename` and find the RAW
+        image data. Raises a ValueError if the file is not a TIFF/DNG file or
+        does not contain CFA data.
+        """
+        self.filename = filename
+
+        with open(filename, "rb") as file:
+            header = file.read(8)
+            if header[:2] == b"II":
+                byteorder = "<"
+            elif header[:2] == b"MM":
+                byteorder = ">"
+            else:
+                raise ValueError(f"`{filename}` is not a TIFF/DNG file.")
+            magic, offset = struct.unpack(byteorder + "HI", header[2:])
+            if magic != 42:
+                raise ValueError(f"`{filename}` is not a (classic) TIFF/DNG file.")
+            ifds = _read_all_ifds(file, offset, byteorder)
+
+        # Find the full-resolution CFA image: the largest CFA image that is not
+        # a reduced-resolution preview
+        candidates = [ifd for ifd in ifds if _value(ifd, "PhotometricInterpretation") == _photometric_CFA and _value(ifd, "NewSubFileType", 0) & 1 == 0]
+        if len(candidates) == 0:
+            raise ValueError(f"`{filename}` does not contain CFA image data.")
+        self.ifd = ifd = max(candidates, key=lambda ifd: _value(ifd, "ImageWidth") * _value(ifd, "ImageLength"))
+
+        # Image properties
+        self.byteorder = byteorder
+        self.shape = (_value(ifd, "ImageLength"), _value(ifd, "ImageWidth"))
+        self.bits_per_sample = _value(ifd, "BitsPerSample")
+        self.compression = _value(ifd, "Compression", 1)
+        self.samples_per_pixel = _value(ifd, "SamplesPerPixel", 1)
+        self.tiled = tags["TileOffsets"] in ifd
+
+        # Colour filter array and levels
+        pattern_shape = ifd.get(tags["CFARepeatPatternDim"], np.array([2, 2]))
+        self.cfa_pattern = ifd[tags["CFAPattern"]].reshape(pattern_shape) if tags["CFAPattern"] in ifd else None
+        self.black_level = ifd.get(tags["BlackLevel"])
+        self.white_level = _value(ifd, "WhiteLevel")
+
+        # The data can only be memory-mapped if they are uncompressed, every
+        # pixel is a whole number of bytes, and the stored values are the RAW
+        # values (LibRaw applies a linearisation table, if there is one)
+        self.linearised = tags["LinearizationTable"] in ifd
+        self.mappable = self.compression == 1 and self.bits_per_sample in (8, 16) and self.samples_per_pixel == 1 and not self.linearised
+        if self.mappable:
+            self.dtype = np.dtype(byteorder + ("u1" if self.bits_per_sample == 8 else "u2"))
+            self._map()
+
+    def __repr__(self):
+        """
+        Text representation of the DNGFile object
+        """
+        layout = "tiles" if self.tiled else "strips"
+        mapped = "memory-mapped" if self.mappable else "not memory-mapped"
+        return f"DNGFile `{self.filename}` ({self.shape[0]}x{self.shape[1]}, {self.bits_per_sample}-bit {layout}, {mapped})"
+
+    @property
+    def bayer_pattern(self):
+        """
+        Bayer pattern in RGBG2 form, as used in `Camera.bayer_pattern` and by
+        rawpy: green pixels in rows without red are G2 (3).
+        """
+        pattern = self.cfa_pattern.astype(np.uint8)
+        rows_without_red = ~(pattern == 0).any(axis=1)
+        pattern[(pattern == 1) & rows_without_red[:, np.newaxis]] = 3
+        return pattern
+
+    def _map(self):
+        """
+        Memory-map the strips or tiles containing the image data.
+        """
+        height, width = self.shape
+        itemsize = self.dtype.itemsize
+        if self.tiled:
+            self.chunk_shape = (_value(self.ifd, "TileLength"), _value(self.ifd, "TileWidth"))
+            offsets = self.ifd[tags["TileOffsets"]]
+        else:
+            self.chunk_shape = (min(_value(self.ifd, "RowsPerStrip", height), height), width)
+            offsets = self.ifd[tags["StripOffsets"]]
+        self.offsets = offsets.astype(np.int64)
+        self.grid = (-(-height // self.chunk_shape[0]), -(-width // self.chunk_shape[1]))
+        chunk_size = self.chunk_shape[0] * self.chunk_shape[1] * itemsize
+
+        # If the chunks are stored back to back in the file, the whole image
+        # (or, for tiles, the whole tile grid) is a single memory map
+        self.contiguous = np.all(np.diff(self.offsets) == chunk_size)
+        if self.contiguous:
+            if self.tiled:
+                self.data = np.memmap(self.filename, dtype=self.dtype, mode="r", offset=self.offsets[0], shape=(*self.grid, *self.chunk_shape))
+            else:
+                self.data = np.memmap(self.filename, dtype=self.dtype, mode="r", offset=self.offsets[0], shape=self.shape)
+        else:
+            self.data = None
+
+    def _chunk(self, index):
+        """
+        Memory-map a single strip or tile, by its `index`. The last strip may
+        be shorter than the others.
+        """
+        if self.data is not None and self.tiled:
+            return self.data[np.unravel_index(index, self.grid)]
+        rows = self.chunk_shape[0]
+        if not self.tiled:
+            rows = min(rows, self.shape[0] - index*rows)
+        return np.memmap(self.filename, dtype=self.dtype, mode="r", offset=self.offsets[index], shape=(rows, self.chunk_shape[1]))
+
+    def read(self, roi=np.s_[:, :]):
+        """
+        Read a region of interest `roi`, given as a tuple of two slices (e.g.
+        `np.s_[100:200, 300:400]`), from the RAW image data.
+
+        If the strips (or, for a ROI within a single tile, the tile) are
+        stored contiguously, the result is a zero-copy read-only view of the
+        file. Otherwise, only the strips or tiles overlapping the ROI are read
+        and the ROI is copied out of them. Data from big-endian files are
+        always converted (copied) to the native byte order.
+
+        Negative steps are not supported.
+        """
+        if not self.mappable:
+            raise ValueError(f"The image data in {self} cannot be memory-mapped.")
+
+        # Convert the ROI into start/stop/step per axis
+        (y0, y1, ystep), (x0, x1, xstep) = [s.indices(n) for s, n in zip(roi, self.shape)]
+        if ystep < 0 or xstep < 0:
+            raise ValueError(f"Negative steps are not supported in a DNG ROI, but got `{roi}`.")
+
+        data = self._read(y0, y1, ystep, x0, x1, xstep)
+
+        # Convert data from big-endian files to the native byte order
+        if not data.dtype.isnative:
+            data = data.astype(data.dtype.newbyteorder("="))
+
+        return data
+
+    def _read(self, y0, y1, ystep, x0, x1, xstep):
+        """
+        Read the ROI given by start/stop/step per axis, in the byte order of
+        the file. Helper function for `read`.
+        """
+        # Whole image in a single memory map: return a view
+        if self.data is not None and not self.tiled:
+            return self.data[y0:y1:ystep, x0:x1:xstep]
+
+        # Otherwise, assemble the ROI from the chunks that overlap it
+        rows, cols = np.arange(y0, y1, ystep), np.arange(x0, x1, xstep)
+        if len(rows) == 0 or len(cols) == 0:
+            return np.empty((len(rows), len(cols)), dtype=self.dtype)
+
+        chunk_rows, chunk_cols = rows // self.chunk_shape[0], cols // self.chunk_shape[1]
+        grid_rows, grid_cols = np.unique(chunk_rows), np.unique(chunk_cols)
+
+        # ROI within a single tile or strip: return a view
+        if len(grid_rows) == 1 and len(grid_cols) == 1:
+            chunk = self._chunk(grid_rows[0] * self.grid[1] + grid_cols[0])
+            cy0, cx0 = grid_rows[0] * self.chunk_shape[0], grid_cols[0] * self.chunk_shape[1]
+            return chunk[y0-cy0:rows[-1]-cy0+1:ystep, x0-cx0:cols[-1]-cx0+1:xstep]
+
+        out = np.empty((len(rows), len(cols)), dtype=self.dtype)
+        for i in grid_rows:
+            rows_here = chunk_rows == i
+            for j in grid_cols:
+                cols_here = chunk_cols == j
+                chunk = self._chunk(i * self.grid[1] + j)
+                out[np.ix_(rows_here, cols_here)] = chunk[np.ix_(rows[rows_here] - i*self.chunk_shape[0], cols[cols_here] - j*self.chunk_shape[1])]
+        return out
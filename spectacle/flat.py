@@ -5,12 +5,16 @@ Code relating to flat-fielding, such as fitting or applying a vignetting model.
 import numpy as np
 from .general import gaussMd, curve_fit, generate_XY, return_with_filename, apply_to_multiple_args
 from . import raw, io
+from .cache import MapCache
 
 parameter_labels = ["k0", "k1", "k2", "k3", "k4", "cx", "cy"]
 parameter_error_labels = ["k0_err", "k1_err", "k2_err", "k3_err", "k4_err", "cx_err", "cy_err"]
 
 _clip_border = np.s_[250:-250, 250:-250]
 
+# Cache of evaluated vignetting correction maps, with a maximum size in MB
+vignette_cache = MapCache(max_size=1024)
+
 
 def clip_data(data, borders=_clip_border):
     """
@@ -29,6 +33,38 @@ def clip_data(data, borders=_clip_border):
     return data_with_nan
 
 
+def _vignette_geometry(shape, cx_hat, cy_hat):
+    """
+    Optical center (cx, cy) of an image with a given `shape`, in absolute
+    (pixel) units, and the euclidean distance m from the optical center to
+    the farthest corner, used to normalise radii.
+    """
+    x0, y0 = 0, 0 # top left corner
+    x1, y1 = shape[1], shape[0]  # bottom right corner
+    cx = x0 + cx_hat * (x1 - x0)
+    cy = y0 + cy_hat * (y1 - y0)
+    # (cx, cy) is the optical center in absolute (pixel) units
+    mx = max([abs(x0 - cx), abs(x1 - cx)])
+    my = max([abs(y0 - cy), abs(y1 - cy)])
+    m = np.sqrt(mx**2 + my**2)
+    # m is the euclidean distance from the optical center to the farthest corner in absolute (pixel) units
+    return cx, cy, m
+
+
+def _vignette_polynomial(r2, k0, k1, k2, k3, k4):
+    """
+    Evaluate the vignetting polynomial 1 + k0 r^2 + k1 r^4 + ... + k4 r^10 at
+    squared radii `r2`, using Horner's method in r^2 with in-place operations
+    on a single output array.
+    """
+    g = r2 * k4
+    for k in (k3, k2, k1, k0):
+        g += k
+        g *= r2
+    g += 1
+    return g
+
+
 def vignette_radial(shape, XY, k0, k1, k2, k3, k4, cx_hat, cy_hat):
     """
     Vignetting function as defined in Adobe DNG standard 1.4.0.0
@@ -50,20 +86,11 @@ def vignette_radial(shape, XY, k0, k1, k2, k3, k4, cx_hat, cy_hat):
     """
     x, y = XY
 
-    x0, y0 = 0, 0 # top left corner
-    x1, y1 = shape[1], shape[0]  # bottom right corner
-    cx = x0 + cx_hat * (x1 - x0)
-    cy = y0 + cy_hat * (y1 - y0)
-    # (cx, cy) is the optical center in absolute (pixel) units
-    mx = max([abs(x0 - cx), abs(x1 - cx)])
-    my = max([abs(y0 - cy), abs(y1 - cy)])
-    m = np.sqrt(mx**2 + my**2)
-    # m is the euclidean distance from the optical center to the farthest corner in absolute (pixel) units
-    r = 1/m * np.sqrt((x - cx)**2 + (y - cy)**2)
-    # r is the normalized euclidean distance of every pixel from the optical center (0-1)
+    cx, cy, m = _vignette_geometry(shape, cx_hat, cy_hat)
+    r2 = ((x - cx)**2 + (y - cy)**2) / m**2
+    # r2 is the squared normalized euclidean distance of every pixel from the optical center (0-1)
 
-    p = [k4, 0, k3, 0, k2, 0, k1, 0, k0, 0, 1]
-    g = np.polyval(p, r)
+    g = _vignette_polynomial(r2, k0, k1, k2, k3, k4)
     # g is the normalization factor to multiply measured values with
 
     return g
@@ -95,24 +122,58 @@ def fit_vignette_radial(correction_observed, **kwargs):
     return popt, standard_errors
 
 
-def apply_vignette_radial(shape, parameters):
+def _evaluate_vignette_radial(shape, parameters, roi, dtype):
+    """
+    Evaluate the radial vignetting function over a region of interest `roi`
+    of an image with a given `shape`. Helper function for
+    `apply_vignette_radial`.
+    """
+    k0, k1, k2, k3, k4, cx_hat, cy_hat = parameters
+    cx, cy, m = _vignette_geometry(shape, cx_hat, cy_hat)
+
+    # The squared radius is the sum of a term per row and a term per column,
+    # so only these need to be calculated, rather than a full meshgrid
+    rows, columns = [np.arange(*s.indices(n)) for s, n in zip(roi, shape)]
+    dy2 = (((rows - cy) / m)**2).astype(dtype)
+    dx2 = (((columns - cx) / m)**2).astype(dtype)
+    r2 = np.add(dy2[:, np.newaxis], dx2[np.newaxis, :])
+
+    # Evaluate the polynomial
+    correction = _vignette_polynomial(r2, *np.array([k0, k1, k2, k3, k4], dtype=dtype))
+    correction.flags.writeable = False
+    return correction
+
+
+def apply_vignette_radial(shape, parameters, roi=np.s_[:, :], dtype=np.float32):
     """
     Apply a radial vignetting function to obtain a correction factor map.
+
+    If a region of interest `roi` is given, as a tuple of two slices (e.g.
+    `np.s_[100:200, 300:400]`, or `np.s_[::2, ::2]` for one Bayer channel),
+    the map is only evaluated there. The result has `dtype` (default:
+    float32).
+
+    Correction maps are cached per set of parameters, shape, ROI, and dtype,
+    so they are read-only. Use `np.copy` on the result if it needs to be
+    modified.
     """
-    X, Y, XY = generate_XY(shape)
-    correction = vignette_radial(shape, XY, *parameters).reshape(shape)
+    roi_indices = tuple(s.indices(n) for s, n in zip(roi, shape))
+    key = (tuple(float(p) for p in parameters), tuple(int(n) for n in shape), roi_indices, np.dtype(dtype).str)
+    correction = vignette_cache.load(key, _evaluate_vignette_radial, shape, parameters, roi, dtype)
     return correction
 
 
-def load_flatfield_correction(root, shape, return_filename=False):
+def load_flatfield_correction(root, shape, return_filename=False, **kwargs):
     """
     Load the flat-field correction model, the parameters of which are contained
-    in `root`/calibration/flatfield_parameters.csv
+    in `root`/calibration/flatfield_parameters.csv, and evaluate it for an
+    image of a given `shape`. Any additional **kwargs, such as a region of
+    interest `roi`, are passed to `apply_vignette_radial`.
     """
     filename = io.find_matching_file(root/"calibration", "flatfield_parameters.csv")
     data = np.loadtxt(filename, delimiter=",")
     parameters, errors = data[:7], data[7:]
-    correction_map = apply_vignette_radial(shape, parameters)
+    correction_map = apply_vignette_radial(shape, parameters, **kwargs)
 
     return return_with_filename(correction_map, filename, return_filename)
 
@@ -123,24 +184,19 @@ def normalise_RGBG2(mean, stds, bayer_pattern):
     """
     # Demosaick the data
     mean_RGBG = raw.demosaick(bayer_pattern, mean)
-    stds_RGBG = raw.demosaick(bayer_pattern, stds)
 
     # Convolve with a Gaussian kernel to find the maxima without being
     # sensitive to outliers
     mean_RGBG_gauss = gaussMd(mean_RGBG, sigma=(0,5,5))
 
-    # Find the maximum per channel and cast these into an array of the same
-    # shape as the data
+    # Find the maximum per channel
     normalisation_factors = mean_RGBG_gauss.max(axis=(1,2))
-    normalisation_array = normalisation_factors[:,np.newaxis,np.newaxis]
-
-    # Normalise the mean and standard deviation data to 1
-    mean_RGBG = mean_RGBG / normalisation_array
-    stds_RGBG = stds_RGBG / normalisation_array
 
-    # Re-mosaick the now-normalised flat-field data
-    mean_remosaicked = raw.put_together_from_colours(mean_RGBG, bayer_pattern)
-    stds_remosaicked = raw.put_together_from_colours(stds_RGBG, bayer_pattern)
+    # Normalise the mean and standard deviation data to 1, directly in the
+    # mosaicked data
+    plan = raw.cfa_plan(bayer_pattern)
+    mean_remosaicked = plan.divide(mean, normalisation_factors)
+    stds_remosaicked = plan.divide(stds, normalisation_factors)
 
     return mean_remosaicked, stds_remosaicked
 
@@ -2,10 +2,23 @@ import rawpy
 import exifread
 import numpy as np
 import os
+import json
+import struct
+from collections import namedtuple
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from matplotlib import pyplot as plt
 from .camera import load_camera, find_root_folder, load_json, write_json
 from .general import find_matching_file
+from .cache import FrameCache
+from . import dng
+
+# Use simplejpeg (libjpeg-turbo) for decoding JPEG images if available, since
+# it is faster than pyplot's `imread`
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
 
 # Default save folder for results
 results_folder = Path.home() / "SPECTACLE_results"
@@ -13,6 +26,33 @@ if not results_folder.exists():
     os.makedirs(results_folder)
     print(f"Created SPECTACLE results folder: {results_folder}")
 
+# Persistent cache of decoded RAW images, disabled (None) by default
+# Use `enable_frame_cache` to enable it
+frame_cache = None
+
+
+def enable_frame_cache(folder=results_folder/"frame_cache", max_size=10240):
+    """
+    Enable the persistent cache of decoded RAW images in `folder`, with a
+    maximum size of `max_size` MB. When enabled, `load_raw_image` returns
+    images from the cache as read-only memory maps, and only decodes files
+    that are not in the cache yet.
+    Returns the FrameCache object.
+    """
+    global frame_cache
+    frame_cache = FrameCache(folder, max_size=max_size)
+    return frame_cache
+
+
+def disable_frame_cache():
+    """
+    Disable the persistent cache of decoded RAW images. The cached files are
+    kept on disk.
+    """
+    global frame_cache
+    frame_cache = None
+
+
 def path_from_input(argv):
     """
     Turn command-line input(s) into Path objects.
@@ -23,9 +63,17 @@ def path_from_input(argv):
         return [Path(a) for a in argv[1:]]
 
 
+# RAW data copied out of a rawpy object, using the same names as rawpy
+RawData = namedtuple("RawData", ["raw_image", "raw_colors", "black_level_per_channel", "white_level"])
+
+
 def load_raw_file(filename):
     """
     Load a raw file using rawpy's `imread` function. Return the rawpy object.
+
+    The rawpy object keeps the LibRaw buffers (and the file) open until it is
+    closed, so use it as a context manager (`with load_raw_file(filename) as
+    img:`) or use `load_raw_data` instead.
     """
     # Convert filename to str because rawpy does not support Path
     filename_as_str = str(filename)
@@ -33,22 +81,96 @@ def load_raw_file(filename):
     return img
 
 
-def load_raw_image(filename):
+def _copy_plane(plane, out=None):
+    """
+    Copy a `plane` (e.g. the raw image) out of a rawpy object, into `out` if
+    given or into a new array otherwise.
+    """
+    if out is None:
+        return plane.copy()
+    out[...] = plane
+    return out
+
+
+def load_raw_data(filename, image=True, colors=False, levels=False, image_out=None, colors_out=None):
+    """
+    Load a raw file using rawpy's `imread` function and copy only the desired
+    data out of it: the image data (if `image` is True), the Bayer colour data
+    (if `colors` is True), and/or the black and white levels (if `levels` is
+    True). The rawpy object is closed immediately afterwards, releasing all
+    LibRaw memory and the file.
+
+    The image and colour data are copied into the pre-allocated arrays
+    `image_out` and `colors_out` if given, and into new arrays otherwise.
+
+    Returns a RawData named tuple with elements `raw_image`, `raw_colors`,
+    `black_level_per_channel`, and `white_level`, like the rawpy object; any
+    data that were not loaded are None.
+    """
+    with load_raw_file(filename) as img:
+        raw_image = _copy_plane(img.raw_image, image_out) if image or image_out is not None else None
+        raw_colors = _copy_plane(img.raw_colors, colors_out) if colors or colors_out is not None else None
+        black_level = list(img.black_level_per_channel) if levels else None
+        white_level = img.white_level if levels else None
+
+    return RawData(raw_image, raw_colors, black_level, white_level)
+
+
+def _decode_raw_image(filename):
+    """
+    Load a raw file using rawpy's `imread` function. Return only the image
+    data. Does not use the frame cache.
+    """
+    return load_raw_data(filename).raw_image
+
+
+def load_raw_image(filename, out=None):
     """
     Load a raw file using rawpy's `imread` function. Return only the image
-    data.
+    data, copied into the pre-allocated array `out` if given.
+
+    If the frame cache is enabled (see `enable_frame_cache`), the image data
+    are loaded from the cache as a read-only memory map if available, and
+    added to it if not.
+    """
+    if frame_cache is not None:
+        data = frame_cache.load(filename, _decode_raw_image)
+        if out is not None:
+            out[...] = data
+            data = out
+        return data
+    else:
+        return load_raw_data(filename, image_out=out).raw_image
+
+
+def load_raw_image_roi(filename, roi=np.s_[:, :]):
     """
-    img = load_raw_file(filename)
-    return img.raw_image
+    Load a region of interest `roi` (a tuple of two slices, e.g.
+    `np.s_[100:200, 300:400]`) from the image data in a raw file.
+
+    Uncompressed DNG files are read directly using `dng.DNGFile`, which
+    memory-maps the image data, so only the ROI is read from disk and, where
+    possible, a read-only view is returned without copying. Other files are
+    decoded completely using rawpy, then the ROI is copied out, so the full
+    decoded image is not kept in memory.
+    """
+    try:
+        dng_file = dng.DNGFile(filename)
+    except (ValueError, OSError, struct.error):
+        dng_file = None
+
+    if dng_file is not None and dng_file.mappable:
+        return dng_file.read(roi)
+    else:
+        return load_raw_image(filename)[roi].copy()
 
 
-def load_raw_colors(filename):
+def load_raw_colors(filename, out=None):
     """
     Load a raw file using rawpy's `imread` function. Return only the Bayer
-    colour data.
+    colour data, copied into the pre-allocated array `out` if given.
     """
-    img = load_raw_file(filename)
-    return img.raw_colors
+    return load_raw_data(filename, image=False, colors=True, colors_out=out).raw_colors
 
 
 def load_raw_image_postprocessed(filename, **kwargs):
@@ -56,66 +178,126 @@ def load_raw_image_postprocessed(filename, **kwargs):
     Load a raw file using rawpy's `imread` function and post-process it.
     Return the post-processed image data.
     """
-    img = load_raw_file(filename)
-    img_post = img.postprocess(**kwargs)
+    with load_raw_file(filename) as img:
+        img_post = img.postprocess(**kwargs)
     return img_post
 
 
-def load_raw_image_multi(folder, pattern="*.dng"):
+def _load_into(arrs, index, load_function, filename):
     """
-    Load many raw files simultaneously and put their image data in a single
-    array.
+    Load the file `filename` using `load_function` and write its image data
+    into the pre-allocated array `arrs` at position `index`.
+    Helper function for `load_multi`.
     """
+    # RAW images can be copied straight out of LibRaw into the array
+    if load_function is load_raw_image:
+        load_raw_image(filename, out=arrs[index])
+    else:
+        arrs[index] = load_function(filename)
 
-    # Find all files in `folder` matching the given pattern `pattern`
-    files = list(folder.glob(pattern))
 
+def load_multi(files, load_function, dtype=None, workers=1, processes=False):
+    """
+    Load the image data from any number of `files` using `load_function` and
+    put them in a single pre-allocated array, in the same order as `files`.
+
+    If `workers` is larger than 1, the files are decoded in parallel. By
+    default a thread pool is used, in which each thread writes its image
+    straight into the output array; this is efficient for decoders that
+    release the GIL, such as rawpy (LibRaw) and Pillow. If `processes` is True,
+    a process pool is used instead, and the decoded images are copied into
+    the output array as they are returned. In this case, `load_function` must
+    be a module-level function so it can be pickled.
+    If `workers` is None, use as many workers as there are CPUs.
+    """
     # Load the first file to get the shape of the images
-    file0 = load_raw_file(files[0])
+    img0 = load_function(files[0])
 
     # Create an array to fit the image contained in each file
-    arrs = np.empty((len(files), *file0.raw_image.shape), dtype=np.uint16)
+    if dtype is None:
+        dtype = img0.dtype
+    arrs = np.empty((len(files), *img0.shape), dtype=dtype)
 
     # Include the already loaded first image in the array
-    arrs[0] = file0.raw_image
+    arrs[0] = img0
+    del img0
+
+    # Determine the number of workers to use
+    if workers is None:
+        workers = os.cpu_count()
 
     # Include the image data from the other files in the array
-    for j, file in enumerate(files[1:], 1):
-        arrs[j] = load_raw_image(file)
+    if workers <= 1 or len(files) <= 2:
+        # Serial loading, one file at a time
+        for j, file in enumerate(files[1:], 1):
+            arrs[j] = load_function(file)
+
+    elif processes:
+        # Parallel loading with a process pool - results are returned in the
+        # same order as `files`
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for j, img in enumerate(executor.map(load_function, files[1:]), 1):
+                arrs[j] = img
+
+    else:
+        # Parallel loading with a thread pool - each thread writes its image
+        # into the output array directly
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_load_into, arrs, j, load_function, file) for j, file in enumerate(files[1:], 1)]
+            # Raise any errors that occurred in the threads
+            for future in futures:
+                future.result()
+
+    return arrs
+
+
+def load_raw_image_multi(folder, pattern="*.dng", workers=1, **kwargs):
+    """
+    Load many raw files simultaneously and put their image data in a single
+    array. The images are in the same order as the files returned by
+    `folder.glob(pattern)`.
+
+    Use `workers` to decode multiple files in parallel (default: 1, serial).
+    Any additional **kwargs are passed to `load_multi`.
+    """
+
+    # Find all files in `folder` matching the given pattern `pattern`
+    files = list(folder.glob(pattern))
+
+    # Load the image data from all files into a single array
+    arrs = load_multi(files, load_raw_image, dtype=np.uint16, workers=workers, **kwargs)
 
     return arrs
 
 
 def load_jpg_image(filename):
     """
-    Load a raw file using pyplot's `imread` function. Return only the image
-    data.
+    Load a jpg file using simplejpeg's `decode_jpeg` function if available,
+    or pyplot's `imread` function otherwise. Return only the image data.
     """
-    img = plt.imread(filename)
+    if simplejpeg is not None and Path(filename).suffix.lower() in (".jpg", ".jpeg"):
+        with open(filename, "rb") as file:
+            img = simplejpeg.decode_jpeg(file.read(), colorspace="RGB")
+    else:
+        img = plt.imread(filename)
     return img
 
 
-def load_jpg_multi(folder, pattern="*.jp*g"):
+def load_jpg_multi(folder, pattern="*.jp*g", workers=1, **kwargs):
     """
     Load many jpg files simultaneously and put their image data in a single
-    array.
+    array. The images are in the same order as the files returned by
+    `folder.glob(pattern)`.
+
+    Use `workers` to decode multiple files in parallel (default: 1, serial).
+    Any additional **kwargs are passed to `load_multi`.
     """
 
     # Find all files in `folder` matching the given pattern `pattern`
     files = list(folder.glob(pattern))
 
-    # Load the first file to get the shape of the images
-    img0 = load_jpg_image(files[0])
-
-    # Create an array to fit the image contained in each file
-    arrs = np.empty((len(files), *img0.shape), dtype=np.uint8)
-
-    # Include the already loaded first image in the array
-    arrs[0] = img0
-
-    # Include the image data from the other files in the array
-    for j, file in enumerate(files[1:], 1):
-        arrs[j] = load_jpg_image(file)
+    # Load the image data from all files into a single array
+    arrs = load_multi(files, load_jpg_image, dtype=np.uint8, workers=workers, **kwargs)
 
     return arrs
 
@@ -130,6 +312,106 @@ def load_exif(filename):
     return exif
 
 
+# EXIF tags needed to group images by their capture settings, and the last
+# of these in the EXIF IFD, after which parsing can stop
+exif_header_tags = {"iso": "ISOSpeedRatings", "exposure_time": "ExposureTime", "model": "Model", "timestamp": "DateTimeOriginal"}
+_exif_header_stop_tag = "DateTimeOriginal"
+
+# Filename of the per-folder index of EXIF header data
+exif_index_filename = "exif_index.json"
+
+
+def _exif_ratio_to_float(value):
+    """
+    Convert an exifread Ratio (or number) `value` to a float.
+    """
+    try:
+        return float(value)
+    except TypeError:
+        return value.num / value.den
+
+
+def load_exif_header(filename):
+    """
+    Load only the EXIF data needed to group images by their capture settings
+    (ISO speed, exposure time, device model, and timestamp) from an image.
+    Maker notes and thumbnails are skipped and parsing stops after the last
+    needed tag, which is much faster than `load_exif` for large files.
+
+    Returns a dictionary with the keys in `exif_header_tags`. Tags that are
+    not present are None.
+    """
+    with open(filename, "rb") as f:
+        exif = exifread.process_file(f, details=False, extract_thumbnail=False, stop_tag=_exif_header_stop_tag)
+
+    # Find each tag in the EXIF IFD or, as in some DNG files, in the main IFD
+    tags = {}
+    for key, tag in exif_header_tags.items():
+        tags[key] = exif.get(f"EXIF {tag}", exif.get(f"Image {tag}"))
+
+    # Convert the tags to JSON-compatible types
+    header = {key: None for key in exif_header_tags}
+    if tags["iso"] is not None:
+        header["iso"] = int(tags["iso"].values[0])
+    if tags["exposure_time"] is not None:
+        header["exposure_time"] = _exif_ratio_to_float(tags["exposure_time"].values[0])
+    if tags["model"] is not None:
+        header["model"] = str(tags["model"]).strip()
+    if tags["timestamp"] is not None:
+        header["timestamp"] = str(tags["timestamp"]).strip()
+
+    return header
+
+
+def load_exif_index(folder, pattern="*", workers=None):
+    """
+    Load the EXIF header data (see `load_exif_header`) for all files in
+    `folder` matching `pattern`, using a per-folder index file
+    (`exif_index_filename`) so files are only parsed once.
+
+    Files that are new, or whose size or modification time changed, are
+    parsed in parallel using `workers` threads (default: None, as many as
+    there are CPUs) and the index is updated.
+    Returns a dictionary with filenames as keys and the EXIF header data,
+    including the file size and modification time, as values.
+    """
+    folder = Path(folder)
+    index_file = folder/exif_index_filename
+
+    # Load the existing index, if any
+    try:
+        index = load_json(index_file)
+    except (FileNotFoundError, ValueError):
+        index = {}
+
+    # Find the files to include, ignoring the index file itself
+    files = sorted(file for file in folder.glob(pattern) if file.is_file() and file.name != exif_index_filename)
+
+    # Check which files are not in the index or have changed
+    stats = {file.name: file.stat() for file in files}
+    to_parse = [file for file in files if file.name not in index or index[file.name]["size"] != stats[file.name].st_size or index[file.name]["mtime"] != stats[file.name].st_mtime_ns]
+
+    # Parse the new or changed files in parallel
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        headers = executor.map(load_exif_header, to_parse)
+        for file, header in zip(to_parse, headers):
+            index[file.name] = {**header, "size": stats[file.name].st_size, "mtime": stats[file.name].st_mtime_ns}
+
+    # Remove files that no longer exist from the index
+    removed = [name for name in index if name not in stats and not (folder/name).exists()]
+    for name in removed:
+        del index[name]
+
+    # Save the index if it changed
+    if len(to_parse) > 0 or len(removed) > 0:
+        write_json(index, index_file)
+
+    # Return the index entries for the requested files only
+    index_files = {file.name: index[file.name] for file in files}
+
+    return index_files
+
+
 def absolute_filename(file):
     """
     Return the absolute filename of a given Path object `file`.
@@ -145,7 +427,7 @@ def expected_array_size(folder, pattern):
     # Make sure `folder` is a Path-like object
     folder = Path(folder)
     files = sorted(folder.glob(pattern))
-    array = np.load(files[0])
+    array = np.load(files[0], mmap_mode="r")
     return np.array(array.shape)
 
 
@@ -156,11 +438,27 @@ def load_npy(folder, pattern, retrieve_value=absolute_filename, selection=np.s_[
     list of values based on their parsing their filenames with a function
     given in the `retrieve_value` keyword. Only return array elements included
     in `selection` (default: all).
+
+    The files are opened as memory maps and `selection` is applied before any
+    data are read, so only the selected elements are loaded from disk. These
+    are copied directly into a single pre-allocated array.
     """
     # Make sure `folder` is a Path-like object
     folder = Path(folder)
     files = sorted(folder.glob(pattern))
-    stacked = np.stack([np.load(f)[selection] for f in files])
+
+    # Open the first file to get the shape and data type of the selection
+    selected0 = np.load(files[0], mmap_mode="r")[selection]
+
+    # Create an array to fit the selected data from each file
+    stacked = np.empty((len(files), *selected0.shape), dtype=selected0.dtype)
+
+    # Copy the selected data from each file into the array
+    stacked[0] = selected0
+    del selected0
+    for j, f in enumerate(files[1:], 1):
+        stacked[j] = np.load(f, mmap_mode="r")[selection]
+
     values = np.array([retrieve_value(f, **kwargs) for f in files])
     return values, stacked
 
@@ -219,10 +517,18 @@ def load_means(folder, **kwargs):
     """
     Quickly load all the mean RAW image stacks in a given folder.
 
-    Load the files in `folder` that follow the pattern `*_mean.npy`.
+    If `folder` is, or contains, a series container file (see
+    `write_series`) that is up to date (see `series_is_up_to_date`) and
+    `retrieve_value` is given explicitly as the function for its independent
+    variable, the stacks are loaded from that file. Otherwise, load the files
+    in `folder` that follow the pattern `*_mean.npy`.
     Any additional **kwargs are passed to `load_npy`.
     """
-    values, means = load_npy(folder, "*_mean.npy", **kwargs)
+    series = _usable_series(folder, "mean", kwargs)
+    if series is not None:
+        values, means = _load_series_array(series, "mean", selection=kwargs.get("selection", np.s_[:]))
+    else:
+        values, means = load_npy(folder, "*_mean.npy", **kwargs)
     return values, means
 
 
@@ -241,10 +547,18 @@ def load_stds(folder, **kwargs):
     """
     Quickly load all the standard deviation RAW image stacks in a given folder.
 
-    Load the files in `folder` that follow the pattern `*_stds.npy`.
+    If `folder` is, or contains, a series container file (see
+    `write_series`) that is up to date (see `series_is_up_to_date`) and
+    `retrieve_value` is given explicitly as the function for its independent
+    variable, the stacks are loaded from that file. Otherwise, load the files
+    in `folder` that follow the pattern `*_stds.npy`.
     Any additional **kwargs are passed to `load_npy`.
     """
-    values, stds = load_npy(folder, "*_stds.npy", **kwargs)
+    series = _usable_series(folder, "stds", kwargs)
+    if series is not None:
+        values, stds = _load_series_array(series, "stds", selection=kwargs.get("selection", np.s_[:]))
+    else:
+        values, stds = load_npy(folder, "*_stds.npy", **kwargs)
     return values, stds
 
 
@@ -259,6 +573,307 @@ def load_jstds(folder, **kwargs):
     return values, stds
 
 
+# Container files consist of a fixed identifier, the length of the header,
+# a JSON header describing the contents, and the arrays themselves. Each
+# array starts at a multiple of the page size so it can be memory-mapped.
+_container_identifier = b"SPECTACLE"
+_container_alignment = 4096
+
+
+def _align(position, alignment=_container_alignment):
+    """
+    Round `position` up to the nearest multiple of `alignment`.
+    """
+    return -(-position // alignment) * alignment
+
+
+def write_container(filename, arrays, metadata):
+    """
+    Write a dictionary of `arrays` to a single container file `filename`,
+    together with a dictionary of `metadata` (which must be JSON-compatible).
+
+    `arrays` may contain (shape, dtype) tuples instead of arrays. In that
+    case, space is reserved in the file but no data are written, so the
+    array can be filled in afterwards through a memory map.
+    Returns a dictionary of writeable memory maps of the arrays.
+    """
+    # Describe the arrays in the header, such that each is page-aligned
+    # The header is encoded twice, since its length affects the first offset
+    descriptions = {}
+    for name, array in arrays.items():
+        shape, dtype = array if isinstance(array, tuple) else (array.shape, array.dtype)
+        descriptions[name] = {"shape": [int(s) for s in shape], "dtype": np.dtype(dtype).str, "offset": 0}
+    for attempt in range(2):
+        header = json.dumps({"metadata": metadata, "arrays": descriptions}).encode("utf-8")
+        position = _align(len(_container_identifier) + 8 + len(header))
+        for description in descriptions.values():
+            description["offset"] = position
+            size = int(np.prod(description["shape"])) * np.dtype(description["dtype"]).itemsize
+            position = _align(position + size)
+
+    # Write the identifier and header, and reserve space for the arrays
+    with open(filename, "wb") as file:
+        file.write(_container_identifier)
+        file.write(len(header).to_bytes(8, "little"))
+        file.write(header)
+        file.truncate(position)
+
+    # Write the arrays into the file through memory maps
+    maps = {}
+    for name, array in arrays.items():
+        description = descriptions[name]
+        maps[name] = np.memmap(filename, dtype=description["dtype"], mode="r+", offset=description["offset"], shape=tuple(description["shape"]))
+        if not isinstance(array, tuple):
+            maps[name][...] = array
+
+    return maps
+
+
+def open_container(filename, mode="r"):
+    """
+    Open a container file `filename` written by `write_container`.
+    Returns its metadata dictionary and a dictionary of memory maps of the
+    arrays in it (read-only by default, see `mode`).
+    """
+    with open(filename, "rb") as file:
+        identifier = file.read(len(_container_identifier))
+        if identifier != _container_identifier:
+            raise ValueError(f"File `{filename}` is not a SPECTACLE container file.")
+        header_length = int.from_bytes(file.read(8), "little")
+        header = json.loads(file.read(header_length).decode("utf-8"))
+
+    arrays = {name: np.memmap(filename, dtype=description["dtype"], mode=mode, offset=description["offset"], shape=tuple(description["shape"])) for name, description in header["arrays"].items()}
+
+    return header["metadata"], arrays
+
+
+# Extension used for series container files
+series_extension = ".series"
+
+# Patterns of the NPY stacks that series container files are made from
+series_patterns = {"mean": "*_mean.npy", "stds": "*_stds.npy"}
+
+# Functions for retrieving the independent variable of a series from filenames
+series_retrieve_functions = {"iso": split_iso, "exposure": split_exposure_time, "polariser": split_pol_angle}
+
+
+def _file_stamps(files):
+    """
+    Names, sizes, and modification times of `files`, used to check whether a
+    series container file is up to date with the NPY stacks it was made from.
+    """
+    stamps = []
+    for file in sorted(files):
+        stat = Path(file).stat()
+        stamps.append([Path(file).name, stat.st_size, stat.st_mtime_ns])
+    return stamps
+
+
+def write_series(filename, values, means, stds, variable="", tile_shape=(256, 256), sources=None):
+    """
+    Write a series of mean and standard deviation stacks `means` and `stds`,
+    with shape (N, H, W), taken at N values `values` of an independent
+    variable (such as ISO speed, exposure time, or polariser angle) to a
+    single series container file `filename`. The name of the independent
+    variable can be given as `variable`, e.g. "iso"; this should be one of the
+    keys in `series_retrieve_functions`.
+
+    The stacks are stored in spatial tiles of shape `tile_shape`, such that
+    all N values of one tile are contiguous on disk. Tiles at the edges of
+    the image are padded with NaN.
+
+    If the stacks were loaded from NPY files, these can be given as a
+    dictionary `sources` with keys "mean" and "stds" and lists of files as
+    values. Their names, sizes, and modification times are stored, so
+    `series_is_up_to_date` can check whether the NPY files have changed since.
+    """
+    values = np.asarray(values)
+    nr_values, *image_shape = means.shape
+    tile_shape = [min(t, s) for t, s in zip(tile_shape, image_shape)]
+    nr_tiles = [-(-s // t) for s, t in zip(image_shape, tile_shape)]
+    tiled_shape = (*nr_tiles, nr_values, *tile_shape)
+
+    # Create the container, with space reserved for the tiled stacks
+    metadata = {"type": "series", "variable": variable, "image_shape": image_shape, "tile_shape": tile_shape}
+    if sources is not None:
+        metadata["sources"] = {name: _file_stamps(files) for name, files in sources.items()}
+    arrays = {"values": values, "mean": (tiled_shape, np.float32), "stds": (tiled_shape, np.float32)}
+    maps = write_container(filename, arrays, metadata)
+
+    # Copy the data into the container one tile at a time
+    for name, data in zip(["mean", "stds"], [means, stds]):
+        tiled = maps[name]
+        for i in range(nr_tiles[0]):
+            for j in range(nr_tiles[1]):
+                rows = np.s_[i*tile_shape[0]:(i+1)*tile_shape[0]]
+                cols = np.s_[j*tile_shape[1]:(j+1)*tile_shape[1]]
+                block = data[:, rows, cols]
+                if block.shape[1:] != tuple(tile_shape):
+                    tiled[i, j] = np.nan
+                tiled[i, j, :, :block.shape[1], :block.shape[2]] = block
+        tiled.flush()
+
+
+def _selection_bounds(selection, image_shape):
+    """
+    Convert a `selection` on an image of shape `image_shape` into row and
+    column bounds and the remaining selection to apply within those bounds.
+    Only selections consisting of slices with positive steps are reduced;
+    for any other selection, the bounds cover the whole image.
+    """
+    if not isinstance(selection, tuple):
+        selection = (selection,)
+
+    # Only slices with a positive step can be reduced to bounds
+    if len(selection) <= 2 and all(isinstance(s, slice) for s in selection):
+        selection = (*selection, np.s_[:])[:2]
+        ranges = [s.indices(n) for s, n in zip(selection, image_shape)]
+        if all(step > 0 for start, stop, step in ranges):
+            bounds = [(start, max(start, stop)) for start, stop, step in ranges]
+            remaining = tuple(np.s_[::step] for start, stop, step in ranges)
+            return bounds, remaining
+
+    bounds = [(0, n) for n in image_shape]
+    return bounds, selection
+
+
+def _untile(tiled, image_shape, tile_shape, selection=np.s_[:]):
+    """
+    Assemble the (N, H, W) stack corresponding to the element `selection` of
+    each image from a tiled array `tiled` of shape (ny, nx, N, th, tw).
+    Only the tiles overlapping the selection are read.
+    """
+    bounds, remaining = _selection_bounds(selection, image_shape)
+    (r0, r1), (c0, c1) = bounds
+    th, tw = tile_shape
+
+    # Create an array to fit the bounding box of the selection
+    result = np.empty((tiled.shape[2], r1-r0, c1-c0), dtype=tiled.dtype)
+
+    # Copy the overlapping part of each tile into the result
+    for i in range(r0 // th, -(-r1 // th)):
+        for j in range(c0 // tw, -(-c1 // tw)):
+            rows_image = np.s_[max(r0, i*th):min(r1, (i+1)*th)]
+            cols_image = np.s_[max(c0, j*tw):min(c1, (j+1)*tw)]
+            rows_tile = np.s_[rows_image.start-i*th:rows_image.stop-i*th]
+            cols_tile = np.s_[cols_image.start-j*tw:cols_image.stop-j*tw]
+            result[:, rows_image.start-r0:rows_image.stop-r0, cols_image.start-c0:cols_image.stop-c0] = tiled[i, j, :, rows_tile, cols_tile]
+
+    # Apply the remainder of the selection within the bounding box
+    result = result[(np.s_[:], *remaining)]
+
+    return result
+
+
+def _load_series_array(filename, name, selection=np.s_[:]):
+    """
+    Load the values of the independent variable and one stack `name`
+    ("mean" or "stds") from a series container file `filename`.
+    Helper function for `load_series`, `load_means`, and `load_stds`.
+    """
+    metadata, arrays = open_container(filename)
+    values = np.array(arrays["values"])
+    stack = _untile(arrays[name], metadata["image_shape"], metadata["tile_shape"], selection)
+    return values, stack
+
+
+def load_series(filename, selection=np.s_[:]):
+    """
+    Load a series container file `filename` written by `write_series`.
+    Returns the values of the independent variable and the mean and standard
+    deviation stacks, with shape (N, H, W). Only return array elements
+    included in `selection` (default: all), which is applied to each image.
+    Only the tiles that overlap the selection are read from disk.
+    """
+    values, means = _load_series_array(filename, "mean", selection=selection)
+    values, stds = _load_series_array(filename, "stds", selection=selection)
+    return values, means, stds
+
+
+def iterate_series_tiles(filename):
+    """
+    Iterate over the spatial tiles in a series container file `filename`.
+    For each tile, yield the selection (slice) it corresponds to in the full
+    image and memory maps of its mean and standard deviation, with shape
+    (N, th, tw). This allows per-pixel fits over a series to be done one
+    contiguous tile at a time. Tiles at the edges of the image are cropped
+    to the image.
+    """
+    metadata, arrays = open_container(filename)
+    (height, width), (th, tw) = metadata["image_shape"], metadata["tile_shape"]
+
+    for i in range(arrays["mean"].shape[0]):
+        for j in range(arrays["mean"].shape[1]):
+            rows = np.s_[i*th:min((i+1)*th, height)]
+            cols = np.s_[j*tw:min((j+1)*tw, width)]
+            crop = np.s_[:, :rows.stop-rows.start, :cols.stop-cols.start]
+            yield (rows, cols), arrays["mean"][i, j][crop], arrays["stds"][i, j][crop]
+
+
+def series_is_up_to_date(filename, name, retrieve_value=None):
+    """
+    Check whether the stack `name` ("mean" or "stds") in a series container
+    file `filename` can be used instead of the NPY stacks next to it.
+
+    This is the case if there are no such NPY stacks, or if they are the same
+    files (names, sizes, and modification times) the series was made from.
+    If a `retrieve_value` function is given, it must also be the one for the
+    independent variable of the series (see `series_retrieve_functions`).
+    """
+    filename = Path(filename)
+    metadata, arrays = open_container(filename)
+
+    # The values in the series must have been retrieved the same way
+    if retrieve_value is not None and series_retrieve_functions.get(metadata["variable"]) is not retrieve_value:
+        return False
+
+    # Series without NPY stacks next to them are always used
+    files = list(filename.parent.glob(series_patterns[name]))
+    if len(files) == 0:
+        return True
+
+    # Otherwise, the NPY stacks must not have changed
+    sources = metadata.get("sources", {}).get(name)
+    return sources == _file_stamps(files)
+
+
+def _usable_series(folder, name, kwargs):
+    """
+    Find a series container file in `folder` that can be used instead of the
+    NPY stacks `name` ("mean" or "stds"), when loading them with the **kwargs
+    `kwargs` for `load_npy`. This is only the case if `retrieve_value` is
+    given explicitly and is the function for the independent variable of the
+    series, no other arguments for `retrieve_value` are given, and the series
+    is up to date. Returns None otherwise.
+    Helper function for `load_means` and `load_stds`.
+    """
+    if "retrieve_value" not in kwargs or set(kwargs) - {"retrieve_value", "selection"}:
+        return None
+
+    series = find_series(folder)
+    if series is None or not series_is_up_to_date(series, name, retrieve_value=kwargs["retrieve_value"]):
+        return None
+
+    return series
+
+
+def find_series(folder):
+    """
+    Find a series container file in `folder`. If `folder` is itself a series
+    container file, it is returned. Returns None if no (unique) series file
+    is found.
+    """
+    folder = Path(folder)
+    if folder.suffix == series_extension and folder.is_file():
+        return folder
+
+    files = list(folder.glob(f"*{series_extension}"))
+    if len(files) == 1:
+        return files[0]
+    else:
+        return None
+
+
 def replace_word_in_path(path, old, new):
     """
     Replace the string `old` with the string `new` in a given `path`.
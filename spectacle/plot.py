@@ -176,19 +176,25 @@ def show_RGBG(data, colour=None, colorbar_label="", saveto=None, **kwargs):
     _saveshow(saveto)
 
 
-def histogram_RGB(data_RGBG, xmin="auto", xmax="auto", nrbins=500, xlabel="", yscale="linear", saveto=None):
+def histogram_RGB(data_RGBG, xmin="auto", xmax="auto", nrbins=500, **kwargs):
     if xmin == "auto":
         xmin = symmetric_percentiles(data_RGBG)[0]
     if xmax == "auto":
         xmax = symmetric_percentiles(data_RGBG)[1]
-    data_KRGB = [data_RGBG.ravel(), data_RGBG[0].ravel(), data_RGBG[1::2].ravel(), data_RGBG[2].ravel()]
+    bins = np.linspace(xmin, xmax, nrbins)
+    counts_RGBG = np.array([np.histogram(data_c, bins=bins)[0] for data_c in data_RGBG])
+    histogram_RGB_counts(counts_RGBG, bins, **kwargs)
+
+
+def histogram_RGB_counts(counts_RGBG, bins, xlabel="", yscale="linear", saveto=None):
+    counts_KRGB = [counts_RGBG.sum(axis=0), counts_RGBG[0], counts_RGBG[1::2].sum(axis=0), counts_RGBG[2]]
     fig, axs = plt.subplots(nrows=4, sharex=True, sharey=True, figsize=(3.3,5), squeeze=True, tight_layout=True, gridspec_kw={"wspace":0, "hspace":0})
-    for data, colour, ax in zip(data_KRGB, "krgb", axs):
-        ax.hist(data.ravel(), bins=np.linspace(xmin, xmax, nrbins), color=colour, edgecolor=colour, density=True)
+    for counts, colour, ax in zip(counts_KRGB, "krgb", axs):
+        ax.hist(bins[:-1], bins=bins, weights=counts, color=colour, edgecolor=colour, density=True)
         ax.grid(True)
     for ax in axs[:3]:
         ax.xaxis.set_ticks_position("none")
-    axs[0].set_xlim(xmin, xmax)
+    axs[0].set_xlim(bins[0], bins[-1])
     axs[3].set_xlabel(xlabel)
     axs[0].set_yscale(yscale)
     axs[2].set_ylabel(25*" "+"Probability density")
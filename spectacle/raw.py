@@ -1,16 +1,304 @@
 import numpy as np
 
+# Cache of Bayer maps that have already been generated, shared between all
+# Camera objects with the same Bayer pattern and image shape
+_bayer_maps = {}
+
+# Cache of CFA plans, one per Bayer pattern
+_cfa_plans = {}
+
+# Size of the block (in pixels) at the top-left of a Bayer map that is used to
+# find its period, which limits the supported period to half of this
+_period_block = 16
+
 
 def _find_offset(color_pattern, colour):
     pos = np.array(np.where(color_pattern == colour)).T[0]
     return pos
 
 
+def _find_period(block, axis, divides=False):
+    """
+    Find the smallest period of a `block` of a Bayer map along an `axis`.
+    If `divides` is True, only periods that divide the size of the block
+    along that axis are accepted, e.g. when the block is a whole tile.
+    """
+    n = block.shape[axis]
+    for period in range(1, n):
+        if divides and n % period:
+            continue
+        if np.array_equal(np.take(block, range(period, n), axis=axis), np.take(block, range(n-period), axis=axis)):
+            return period
+    return n
+
+
+def bayer_tile(color_pattern):
+    """
+    Get the repeating tile of a colour filter array (the channel for each
+    pixel) as a uint8 array, e.g. 2x2 for RGBG Bayer or 4x4 for Quad-Bayer.
+    `color_pattern` can be a tile (such as `Camera.bayer_pattern`) or a full
+    Bayer map, of which only the top-left pixels are used.
+
+    A `color_pattern` that fits within the top-left block is treated as a
+    tile that repeats as a whole, so it is only reduced to a smaller tile that
+    repeats exactly within it (e.g. a 4x4 tile of 2x2 RGBG Bayer).
+    """
+    color_pattern = np.asarray(color_pattern)
+    block = color_pattern[:_period_block, :_period_block]
+    is_tile = block.shape == color_pattern.shape
+    period = [_find_period(block, axis, divides=is_tile) for axis in (0, 1)]
+    tile = np.array(block[:period[0], :period[1]], dtype=np.uint8)
+    return tile
+
+
+def bayer_offsets(color_pattern):
+    """
+    Find the (row, column) offset of each channel within the Bayer tile,
+    using only the top-left pixels of a Bayer map `color_pattern`. A Bayer
+    tile (such as `Camera.bayer_pattern`) may be given instead of a full
+    Bayer map. For channels that occur multiple times in the tile (e.g. G in
+    Quad-Bayer), the first occurrence is used.
+    """
+    tile = bayer_tile(color_pattern)
+    offsets = np.array([_find_offset(tile, colour) for colour in np.unique(tile)])
+    return offsets
+
+
+def generate_bayer_map(color_pattern, shape):
+    """
+    Generate a Bayer map, with the Bayer channel (e.g. RGBG2) for each pixel,
+    of a given `shape`, by repeating the Bayer tile in `color_pattern`.
+
+    The Bayer map is stored as uint8 and cached, so all callers with the same
+    Bayer pattern and shape share a single, read-only instance.
+    """
+    plan = cfa_plan(color_pattern)
+    key = (plan.tile.shape, plan.tile.tobytes(), tuple(shape))
+    try:
+        bayer_map = _bayer_maps[key]
+    except KeyError:
+        bayer_map = plan.broadcast(plan.channels, shape)
+        bayer_map.flags.writeable = False
+        bayer_map = _bayer_maps.setdefault(key, bayer_map)
+
+    return bayer_map
+
+
+class CFAPlan(object):
+    """
+    Plan for operations on mosaicked data with a given colour filter array
+    (CFA), precomputed once from its repeating tile. Any periodic pattern is
+    supported, such as 2x2 RGBG Bayer, 4x4 Quad-Bayer, or RGBW.
+
+    The plan stores, for each channel, its positions within the tile and the
+    corresponding strided slices, so splitting, re-mosaicking, and per-channel
+    operations are done with slice assignments instead of scanning a full
+    Bayer map with masks or `np.where`. All operations work on data of shape
+    (..., H, W).
+    """
+    def __init__(self, color_pattern):
+        """
+        Generate a CFA plan from a Bayer tile or Bayer map `color_pattern`.
+        """
+        self.tile = bayer_tile(color_pattern)
+        self.period = self.tile.shape
+        self.channels = np.unique(self.tile)
+        self.offsets = bayer_offsets(self.tile)
+
+        # Strided slices for every position of every channel within the tile
+        py, px = self.period
+        self.positions = [np.argwhere(self.tile == colour) for colour in self.channels]
+        self.slices = [[np.s_[..., x::py, y::px] for x, y in positions] for positions in self.positions]
+
+        # If every channel covers the same rectangular grid of rows and columns
+        # within the tile (e.g. 1x1 for RGBG, 2x2 for Quad-Bayer), each channel
+        # forms a regular image and the data can be split into these
+        grids = [(list(np.unique(positions[:,0])), list(np.unique(positions[:,1]))) for positions in self.positions]
+        blocks = [(len(rows), len(cols)) for rows, cols in grids]
+        regular = all(nr*nc == len(positions) for (nr, nc), positions in zip(blocks, self.positions))
+        if regular and len(set(blocks)) == 1:
+            self.block = nr, nc = blocks[0]
+            # Slices into the split data, for every position of every channel
+            self._targets = [[np.s_[..., j, rows.index(x)::nr, cols.index(y)::nc] for x, y in positions] for j, (positions, (rows, cols)) in enumerate(zip(self.positions, grids))]
+        else:
+            self.block = self._targets = None
+
+    def __repr__(self):
+        """
+        Text representation of the CFAPlan object
+        """
+        return f"CFAPlan({self.tile.tolist()})"
+
+    def _channel_shape(self, shape):
+        """
+        Shape of a single channel image for mosaicked data of shape `shape`.
+        """
+        (py, px), (nr, nc) = self.period, self.block
+        return (shape[-2]//py*nr, shape[-1]//px*nc)
+
+    def split(self, data, views=False):
+        """
+        Split mosaicked `data` of shape (..., H, W) into its channels, giving
+        a new array of shape (..., C, H', W'), with C channels of H' x W'
+        pixels each (e.g. (..., 4, H/2, W/2) for RGBG Bayer data).
+
+        If `views` is True, return a tuple of strided views into `data`
+        instead. This is only possible if each channel occurs once per tile.
+
+        Raises a ValueError if the channels do not form regular images, as in
+        some RGBW layouts; use `split_full` for these.
+        """
+        if self.block is None:
+            raise ValueError(f"The channels in {self} do not form regular images; use `split_full` instead.")
+
+        if views:
+            if self.block != (1, 1):
+                raise ValueError(f"The channels in {self} occur more than once per tile and cannot be split into views.")
+            return tuple(data[slices[0]] for slices in self.slices)
+
+        # Copy the channels into a single pre-allocated array
+        out = np.empty((*data.shape[:-2], len(self.channels), *self._channel_shape(data.shape)), dtype=data.dtype)
+        for slices, targets in zip(self.slices, self._targets):
+            for s, t in zip(slices, targets):
+                out[t] = data[s]
+        return out
+
+    def merge(self, channels, out=None):
+        """
+        Put channel data of shape (..., C, H', W') back together into
+        mosaicked data of shape (..., H, W). Inverse of `split`. The result
+        is written into `out` if given.
+        """
+        if self.block is None:
+            raise ValueError(f"The channels in {self} do not form regular images and cannot be merged.")
+
+        channels = np.asarray(channels)
+        if out is None:
+            (py, px), (nr, nc) = self.period, self.block
+            out = np.empty((*channels.shape[:-3], channels.shape[-2]//nr*py, channels.shape[-1]//nc*px), dtype=channels.dtype)
+        for slices, targets in zip(self.slices, self._targets):
+            for s, t in zip(slices, targets):
+                out[s] = channels[t]
+        return out
+
+    def split_full(self, data, color_desc=None, fill=np.nan, dtype=np.float64):
+        """
+        Split mosaicked `data` of shape (..., H, W) into full-resolution
+        images of shape (..., C, H, W), one per colour, filled with `fill`
+        (default: NaN) where the colour is not present.
+
+        If a colour description `color_desc` (e.g. "RGBG") is given, channels
+        with the same colour are merged, e.g. G and G2 into a single G image.
+        Works for any periodic pattern.
+        """
+        if color_desc is None:
+            colour_index = list(range(len(self.channels)))
+        else:
+            colours = list(dict.fromkeys(color_desc))
+            colour_index = [colours.index(colour) for colour in color_desc]
+
+        out = np.full((*data.shape[:-2], max(colour_index)+1, *data.shape[-2:]), fill, dtype=dtype)
+        for k, slices in zip(colour_index, self.slices):
+            out_colour = out[..., k, :, :]
+            for s in slices:
+                out_colour[s] = data[s]
+        return out
+
+    def multiply(self, data, factors, out=None):
+        """
+        Multiply each channel in mosaicked `data` by a factor in `factors`.
+        The result is written into `out` if given, which may be `data` itself
+        to work in place; otherwise, a copy is made.
+        """
+        if out is None:
+            out = data.copy()
+        elif out is not data:
+            out[...] = data
+        for slices, factor in zip(self.slices, factors):
+            for s in slices:
+                out[s] *= factor
+        return out
+
+    def divide(self, data, divisors, out=None):
+        """
+        Divide each channel in mosaicked `data` by a value in `divisors`.
+        The result is written into `out` if given; otherwise, a new
+        floating-point array is made.
+        """
+        divisors = np.asarray(divisors)
+        if out is None:
+            out = np.empty(data.shape, dtype=np.result_type(data.dtype, divisors.dtype, np.float32))
+        for slices, divisor in zip(self.slices, divisors):
+            for s in slices:
+                np.divide(data[s], divisor, out=out[s])
+        return out
+
+    def reduce(self, data, function, **kwargs):
+        """
+        Apply a reduction `function` (such as `np.mean`) to each channel in
+        mosaicked `data` of shape (..., H, W), over the image axes, giving a
+        result of shape (..., C). Channels are accessed through strided views,
+        so the data are not demosaicked into a copy first.
+        Any additional **kwargs are passed to `function`.
+        """
+        results = []
+        for slices in self.slices:
+            if len(slices) == 1:
+                result = function(data[slices[0]], axis=(-2, -1), **kwargs)
+            # Channels that occur multiple times per tile (e.g. Quad-Bayer)
+            # are combined into one array, only for this channel
+            else:
+                result = function(np.stack([data[s] for s in slices], axis=-3), axis=(-3, -2, -1), **kwargs)
+            results.append(result)
+        return np.stack(results, axis=-1)
+
+    def broadcast(self, values, shape, dtype=None):
+        """
+        Generate a mosaicked array of a given `shape`, with one value from
+        `values` per channel, e.g. to turn per-channel bias values into a
+        bias map.
+        """
+        values = np.asarray(values)
+        out = np.empty(shape, dtype=values.dtype if dtype is None else dtype)
+        for slices, value in zip(self.slices, values):
+            for s in slices:
+                out[s] = value
+        return out
+
+
+def cfa_plan(color_pattern):
+    """
+    Get the CFA plan for a Bayer tile or Bayer map `color_pattern`.
+    Plans are cached, so they are only computed once per Bayer pattern.
+    """
+    # A CFAPlan can be passed directly
+    if isinstance(color_pattern, CFAPlan):
+        return color_pattern
+
+    tile = bayer_tile(color_pattern)
+    key = (tile.shape, tile.tobytes())
+    try:
+        plan = _cfa_plans[key]
+    except KeyError:
+        plan = _cfa_plans.setdefault(key, CFAPlan(tile))
+
+    return plan
+
+
 def demosaick(bayer_map, *data, **kwargs):
     """
     Simplified demosaicking method for RGBG data.
     Uses a Bayer map `bayer_map` (RGBG channel for each pixel) and any number
     of input arrays `data`. Any additional **kwargs are passed to pull_apart.
+
+    The input arrays may have any number of dimensions; by default, the last
+    two are the image axes, so e.g. an (N, H, W) series is split into
+    (N, 4, H/2, W/2) in one operation. Use `axes` to select different image
+    axes, e.g. `axes=(0, 1)` for (H, W, 3) data, giving (3, 4, H/2, W/2).
+
+    With `views=True`, each array is split into a tuple of four strided views
+    (R, G, B, G2) into the original data, without copying. Otherwise, a new
+    (..., 4, H/2, W/2) array is returned for each.
     """
     # Demosaick the data
     data_RGBG = [pull_apart(data_array, bayer_map, **kwargs)[0] for data_array in data]
@@ -22,29 +310,73 @@ def demosaick(bayer_map, *data, **kwargs):
     return data_RGBG
 
 
-def pull_apart(raw_img, color_pattern, color_desc="RGBG"):
-    if color_desc not in ("RGBG", b"RGBG"):
-        raise ValueError(f"Unknown colour description `{color_desc}")
-    offsets = np.array([_find_offset(color_pattern, i) for i in range(4)])
-    offX, offY = offsets.T
-    R, G, B, G2 = [raw_img[x::2, y::2] for x, y in zip(offX, offY)]
-    RGBG = np.stack((R, G, B, G2))
-    return RGBG, offsets
+def remosaick(bayer_map, *data):
+    """
+    Inverse of `demosaick`: put RGBG2 data of shape (..., 4, H/2, W/2) back
+    together into mosaicked data of shape (..., H, W), using a Bayer map
+    `bayer_map` (RGBG channel for each pixel) or 2x2 Bayer tile.
+    Any number of input arrays `data` can be given.
+    """
+    # Re-mosaick the data
+    data_remosaicked = [put_together_from_colours(data_array, bayer_map) for data_array in data]
+
+    # If only a single array was given, don't return a list
+    if len(data_remosaicked) == 1:
+        data_remosaicked = data_remosaicked[0]
+
+    return data_remosaicked
+
+
+def pull_apart(raw_img, color_pattern, color_desc="RGBG", views=False, axes=(-2, -1)):
+    """
+    Split `raw_img` into its RGBG2 channels, using the Bayer map or Bayer
+    tile `color_pattern`. Only the top-left pixels of `color_pattern` are
+    used to find the channel offsets. Other periodic layouts, such as
+    Quad-Bayer or RGBW, are supported too, as long as `color_desc` has one
+    letter per channel; see `CFAPlan.split`.
+
+    `raw_img` may have any number of dimensions, with the image axes given by
+    `axes` (default: the last two). Any other axes are kept in front, so the
+    result has a shape (..., 4, H/2, W/2).
+
+    If `views` is True, return a tuple of four strided views (R, G, B, G2)
+    into `raw_img`, without copying any data. NumPy cannot represent the four
+    channels as a single (4, H/2, W/2) view, since their offsets within the
+    2x2 tile are not evenly spaced in memory. Otherwise (default), copy the
+    channels into a new contiguous (..., 4, H/2, W/2) array.
+
+    Also returns the channel offsets.
+    """
+    plan = cfa_plan(color_pattern)
+    if len(color_desc) != len(plan.channels):
+        raise ValueError(f"Colour description `{color_desc}` does not match the {len(plan.channels)} channels in {plan}")
+
+    # Move the image axes to the end (this does not copy any data)
+    raw_img = np.moveaxis(raw_img, axes, (-2, -1))
+    RGBG = plan.split(raw_img, views=views)
+
+    return RGBG, plan.offsets
 
 
 def put_together_from_offsets(R, G, B, G2, offsets):
-    result = np.zeros((R.shape[0]*2, R.shape[1]*2))
+    """
+    Put the RGBG2 channels `R`, `G`, `B`, `G2`, each of shape (..., H/2, W/2),
+    back together into an array of shape (..., H, W), using the channel
+    offsets within the 2x2 Bayer tile (see `bayer_offsets`).
+    """
+    result = np.empty((*R.shape[:-2], R.shape[-2]*2, R.shape[-1]*2), dtype=R.dtype)
     for colour, offset in zip([R,G,B,G2], offsets):
         x, y = offset
-        result[x::2, y::2] = colour
-    result = result.astype(R.dtype)
+        result[..., x::2, y::2] = colour
     return result
 
 
 def put_together_from_colours(RGBG, colours):
-    original = np.zeros((2*RGBG.shape[1], 2*RGBG.shape[2]))
-    for j in range(4):
-        original[np.where(colours == j)] = RGBG[j].ravel()
+    """
+    Put RGBG2 data of shape (..., 4, H/2, W/2) back together into an array of
+    shape (..., H, W), using a Bayer map or 2x2 Bayer tile `colours`.
+    """
+    original = cfa_plan(colours).merge(RGBG)
     return original
 
 
@@ -54,18 +386,58 @@ def split_RGBG(RGBG):
 
 
 def to_RGB_array(raw_image, color_pattern):
+    """
+    Convert a mosaicked `raw_image` into an (H, W, 3) RGB array, with each
+    pixel's value in its own colour (both G and G2 go into G) and 0 in the
+    others. `color_pattern` can be a Bayer map or 2x2 Bayer tile.
+    See `bin_RGB` for a more compact, half-resolution alternative.
+    """
     RGB = np.zeros((*raw_image.shape, 3))
-    R_ind = np.where(color_pattern == 0)
-    G_ind = np.where((color_pattern == 1) | (color_pattern == 3))
-    B_ind = np.where(color_pattern == 2)
-    RGB[R_ind[0], R_ind[1], 0] = raw_image[R_ind]
-    RGB[G_ind[0], G_ind[1], 1] = raw_image[G_ind]
-    RGB[B_ind[0], B_ind[1], 2] = raw_image[B_ind]
+    for j, slices in zip([0, 1, 2, 1], cfa_plan(color_pattern).slices):
+        for s in slices:
+            RGB[..., j][s] = raw_image[s]
     return RGB
 
 
+def bin_RGB(raw_image, color_pattern, color_desc="RGBG", dtype=np.float32, out=None):
+    """
+    Bin mosaicked `raw_image` data of shape (..., H, W) into RGB superpixels
+    of shape (..., H/2, W/2, 3), using the Bayer map or Bayer tile
+    `color_pattern`. Channels with the same colour in `color_desc` (G and G2
+    in RGBG) are averaged.
+
+    The result has data type `dtype` (default: float32) and is written into a
+    pre-allocated array `out` if given. Unlike `to_RGB_array`, this does not
+    create a full-resolution array that is mostly zeros.
+    """
+    if isinstance(color_desc, bytes):
+        color_desc = color_desc.decode()
+
+    channels = cfa_plan(color_pattern).split(raw_image, views=True)
+    if out is None:
+        out = np.empty((*channels[0].shape, 3), dtype=dtype)
+
+    # Add up the channels per colour, then divide by the number of channels
+    counts = [0, 0, 0]
+    for channel, colour in zip(channels, color_desc):
+        k = "RGB".index(colour)
+        if counts[k] == 0:
+            out[..., k] = channel
+        else:
+            out[..., k] += channel
+        counts[k] += 1
+
+    for k, count in enumerate(counts):
+        if count > 1:
+            out[..., k] /= count
+
+    return out
+
+
 def multiply_RGBG(data, colours, factors):
-    data_new = data.copy()
-    for j in range(4):
-        data_new[colours == j] *= factors[j]
+    """
+    Multiply each RGBG2 channel in mosaicked `data` by a factor in `factors`,
+    using a Bayer map or 2x2 Bayer tile `colours`.
+    """
+    data_new = cfa_plan(colours).multiply(data, factors)
     return data_new
@@ -1,29 +1,14 @@
-import numpy as np
+from .raw import cfa_plan
 
 
 def pull_apart2(raw_img, color_pattern, color_desc="RGBG", remove=True):
-    unique_colours = np.unique(color_pattern)
-
-    stack = np.tile(np.nan, (*unique_colours.shape, *raw_img.shape))
-    for j in range(len(unique_colours)):
-        indices = np.where(color_pattern == j)
-        stack[j][indices] = raw_img[indices]
-
-    if remove and len(set(color_desc)) != len(color_desc):
-        to_remove = []
-        for j in range(1, len(unique_colours)):
-            colour = color_desc[j]
-            previous = color_desc[:j]
-            try:
-                ind_previous = previous.index(colour)
-            except ValueError:
-                continue
-            stack[ind_previous][color_pattern == j] = stack[j][color_pattern == j]
-            to_remove.append(j)
-        clean_stack = np.delete(stack, to_remove, axis=0)
-    else:
-        clean_stack = stack.copy()
-
-    assert len(np.where(np.nansum(clean_stack, axis=0) != raw_img)[0]) == 0
-
+    """
+    Split `raw_img` into full-resolution images, one per channel, filled with
+    NaN where that channel is not present, using the Bayer map or Bayer tile
+    `color_pattern`. Works for any periodic colour filter pattern.
+
+    If `remove` is True, channels with the same colour in `color_desc` (e.g.
+    G and G2 in RGBG) are merged into a single image.
+    """
+    clean_stack = cfa_plan(color_pattern).split_full(raw_img, color_desc=color_desc if remove else None)
     return clean_stack
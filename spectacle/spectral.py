@@ -1,7 +1,7 @@
 import numpy as np
 from matplotlib import pyplot as plt
 
-from . import io, plot
+from . import io, plot, analyse
 from .general import return_with_filename, apply_to_multiple_args, deprecation
 from ._xyz import wavelengths as cie_wavelengths, xyz as cie_xyz
 
@@ -58,41 +58,25 @@ def load_monochromator_data(root, folder, blocksize=100):
     # Half-blocksize, to slice the arrays with
     d = blocksize//2
 
-    # Empty arrays to hold the output
-    wvls  = np.zeros((len(mean_files)))
-    means = np.zeros((len(mean_files), 4))
-    stds  = means.copy()
+    # The central blocksize x blocksize pixels in each demosaicked channel,
+    # as an (even-aligned) slice of the mosaicked data
+    midx, midy = np.array(camera.image_shape)//4
+    central = np.s_[2*(midx-d):2*(midx+d+1), 2*(midy-d):2*(midy+d+1)]
 
-    # Loop over all files
-    print("Wavelengths [nm]:", end=" ", flush=True)
-    for j, (mean_file, stds_file) in enumerate(zip(mean_files, stds_files)):
-        # Load the mean data
-        m = np.load(mean_file)
+    # Load the data and apply a bias correction, keeping only the central
+    # pixels of each wavelength
+    wvls = np.array([float(mean_file.stem.split("_")[0]) for mean_file in mean_files])
+    print("Wavelengths [nm]:", *wvls)
+    m = np.stack([camera.correct_bias(np.load(mean_file))[central] for mean_file in mean_files])
 
-        # Bias correction
-        m = camera.correct_bias(m)
+    # Take the mean value and standard deviation per Bayer channel
+    means = analyse.mean_RGBG2(m, camera.cfa)
+    stds = analyse.std_RGBG2(m, camera.cfa)
 
-        # Demosaick the data
-        mean_RGBG = camera.demosaick(m)
+    # NaN if a channel's mean value is near saturation
+    means[means >= 0.95 * camera.saturation] = np.nan
 
-        # Select the central blocksize x blocksize pixels
-        midx, midy = np.array(mean_RGBG.shape[1:])//2
-        sub = mean_RGBG[:,midx-d:midx+d+1,midy-d:midy+d+1]
-
-        # Take the mean value per Bayer channel
-        m = sub.mean(axis=(1,2))
-
-        # NaN if a channel's mean value is near saturation
-        m[m >= 0.95 * camera.saturation] = np.nan
-
-        # Store results
-        means[j] = m
-        stds[j] = sub.std(axis=(1,2))
-        wvls[j] = mean_file.stem.split("_")[0]
-
-        print(wvls[j], end=" ", flush=True)
-
-    print("\n...Finished!")
+    print("...Finished!")
 
     spectrum = np.stack([wvls, *means.T, *stds.T]).T
     return spectrum
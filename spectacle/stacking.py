@@ -0,0 +1,525 @@
+"""
+Code relating to stacking images, such as calculating the mean and standard
+deviation per pixel over a series of exposures without loading all of them
+into memory at once.
+"""
+
+import numpy as np
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from . import io
+
+
+def _welford_update(frame, count, mean, M2, delta, delta2):
+    """
+    Update the running `mean` and sum of squared differences `M2` in place
+    with a new `frame`, which is frame number `count` (counting from 1).
+    `delta` and `delta2` are pre-allocated buffers with the same shape as
+    `mean`, so no new frame-sized arrays are allocated.
+
+    Reference:
+        https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Welford's_online_algorithm
+    """
+    # Difference between the new frame and the old mean
+    np.subtract(frame, mean, out=delta)
+
+    # Update the mean
+    np.multiply(delta, 1/count, out=delta2)
+    mean += delta2
+
+    # Difference between the new frame and the new mean
+    np.subtract(frame, mean, out=delta2)
+
+    # Update the sum of squared differences
+    delta *= delta2
+    M2 += delta
+
+
+class _WelfordAccumulator(object):
+    """
+    Running mean and standard deviation per pixel, updated one frame at a
+    time with Welford's online algorithm. Accumulates in float64.
+    """
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.M2 = np.zeros_like(self.mean)
+        self.delta = np.empty_like(self.mean)
+        self.delta2 = np.empty_like(self.mean)
+
+    def add(self, frame):
+        """
+        Include a new `frame` in the running mean and standard deviation.
+        """
+        self.count += 1
+        _welford_update(frame, self.count, self.mean, self.M2, self.delta, self.delta2)
+
+    def result(self, dtype=np.float32):
+        """
+        Return the mean and (population) standard deviation as `dtype`.
+        """
+        # Convert the sum of squared differences to a standard deviation
+        # The `delta` buffer is re-used to avoid allocating a new array
+        np.divide(self.M2, self.count, out=self.delta)
+        np.sqrt(self.delta, out=self.delta)
+        return self.mean.astype(dtype), self.delta.astype(dtype)
+
+
+class _IntegerAccumulator(object):
+    """
+    Running sum and sum of squares per pixel for 8-bit integer data (such as
+    JPEG images), accumulated in integers so the result is exact.
+    uint32 accumulators are used if they cannot overflow for `nr_frames`
+    frames, uint64 otherwise.
+    """
+    def __init__(self, shape, nr_frames):
+        self.count = 0
+        dtype = np.uint32 if nr_frames * 255**2 < 2**32 else np.uint64
+        self.sum = np.zeros(shape, dtype=dtype)
+        self.sum2 = np.zeros_like(self.sum)
+        self.buffer = np.empty_like(self.sum)
+
+    def add(self, frame):
+        """
+        Include a new `frame` in the running sums.
+        """
+        self.count += 1
+        self.sum += frame
+        np.multiply(frame, frame, out=self.buffer, dtype=self.buffer.dtype)
+        self.sum2 += self.buffer
+
+    def result(self, dtype=np.float32):
+        """
+        Return the mean and (population) standard deviation as `dtype`.
+        """
+        mean = self.sum / self.count
+        variance = self.sum2 / self.count - mean**2
+        np.clip(variance, 0, None, out=variance)  # Remove rounding errors
+        return mean.astype(dtype), np.sqrt(variance).astype(dtype)
+
+
+def _new_accumulator(frame, nr_frames):
+    """
+    Create an accumulator for frames like `frame`: integer accumulation for
+    8-bit data, Welford's algorithm otherwise.
+    """
+    if frame.dtype == np.uint8:
+        return _IntegerAccumulator(frame.shape, nr_frames)
+    else:
+        return _WelfordAccumulator(frame.shape)
+
+
+def iterate_frames(*file_lists, load_functions=(io.load_raw_image,), workers=1):
+    """
+    Iterate over the frames in any number of equally long lists of files
+    `file_lists`, for example RAW files and the corresponding JPEG files.
+    The files in each list are loaded with the corresponding function in
+    `load_functions`. For each frame, yield a list of the loaded images, one
+    per file list, in the same order as the file lists.
+
+    If `workers` is larger than 1, the next frames are decoded in parallel
+    by a thread pool while the current one is processed. At most 2*`workers`
+    frames are loaded at the same time, so the memory usage does not depend
+    on the number of frames. If `workers` is None, use as many workers as
+    there are CPUs.
+    """
+    assert len(file_lists) == len(load_functions), f"Got {len(file_lists)} lists of files but {len(load_functions)} load functions."
+    assert len(set(len(files) for files in file_lists)) == 1, "All lists of files must have the same length."
+
+    if workers is None:
+        workers = os.cpu_count()
+
+    # Serial loading, one frame at a time
+    if workers <= 1:
+        for frame_files in zip(*file_lists):
+            yield [load_function(file) for load_function, file in zip(load_functions, frame_files)]
+        return
+
+    # Parallel loading, keeping a limited number of frames in flight
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for frame_files in zip(*file_lists):
+            pending.append([executor.submit(load_function, file) for load_function, file in zip(load_functions, frame_files)])
+            if len(pending) >= 2*workers:
+                yield [future.result() for future in pending.popleft()]
+        while pending:
+            yield [future.result() for future in pending.popleft()]
+
+
+def pair_files(files, other_files):
+    """
+    Pair each file in `files` with the file in `other_files` that has the
+    same name apart from the extension, e.g. `IMG_0001.dng` and
+    `IMG_0001.jpg`. Returns the two lists of files in matching order, or None
+    if not every file has a counterpart.
+    """
+    others_by_stem = {file.stem: file for file in other_files}
+    if len(files) != len(other_files) or any(file.stem not in others_by_stem for file in files):
+        return None
+
+    others_matched = [others_by_stem[file.stem] for file in files]
+    return files, others_matched
+
+
+def stack_streaming(*file_lists, load_functions=(io.load_raw_image,), workers=1, dtype=np.float32):
+    """
+    Calculate the mean and standard deviation per pixel over all images in
+    any number of equally long lists of files `file_lists`, loading one frame
+    at a time using `iterate_frames`. This allows, for example, RAW and JPEG
+    files to be stacked in a single pass. The files in each list are loaded
+    with the corresponding function in `load_functions`.
+
+    8-bit data (such as JPEG images) are accumulated exactly, as integer sums
+    and sums of squares. Other data are accumulated in float64 using
+    Welford's online algorithm.
+
+    Returns a list containing the mean and standard deviation, as `dtype`
+    (default: float32), for each list of files. The standard deviation is the
+    population standard deviation (ddof=0), as in `numpy.std`.
+    """
+    # Make sure there is something to stack
+    nr_frames = len(file_lists[0])
+    assert nr_frames > 0, "No files given to stack."
+
+    # Include the images, one frame at a time
+    accumulators = None
+    for frame in iterate_frames(*file_lists, load_functions=load_functions, workers=workers):
+        # Create the accumulators based on the first frame
+        if accumulators is None:
+            accumulators = [_new_accumulator(image, nr_frames) for image in frame]
+
+        for accumulator, image in zip(accumulators, frame):
+            accumulator.add(image)
+        del frame
+
+    results = [accumulator.result(dtype=dtype) for accumulator in accumulators]
+
+    return results
+
+
+def stack_mean_std(files, load_function=io.load_raw_image, dtype=np.float32, workers=1):
+    """
+    Calculate the mean and standard deviation per pixel over all images in
+    `files`. Images are loaded one at a time using `load_function` (default:
+    `io.load_raw_image`), so the memory usage does not depend on the number
+    of images. See `stack_streaming` for details.
+    """
+    mean, stds = stack_streaming(files, load_functions=[load_function], workers=workers, dtype=dtype)[0]
+    return mean, stds
+
+
+# Default memory budget for stacking, in MB
+default_memory_budget = 2048
+
+# Number of bytes needed per frame per pixel when calculating the mean and
+# standard deviation of a tile: the input data plus two float32 working arrays
+_bytes_per_value_float = 8
+
+# Number of bytes needed per frame per pixel when also calculating robust
+# statistics (median and sigma-clipped mean and standard deviation) of a tile:
+# a float32 copy of the data, its deviations from the mean, an outlier mask,
+# and a copy for the median
+_bytes_per_value_robust = _bytes_per_value_float + 16
+
+# Default sigma-clipping parameters for robust statistics
+default_clip_sigma = 3
+default_clip_iterations = 5
+
+
+def _cube_size(nr_frames, image_shape, itemsize):
+    """
+    Number of bytes needed to hold `nr_frames` images of shape `image_shape`
+    with an item size of `itemsize` bytes.
+    """
+    return nr_frames * int(np.prod(image_shape)) * itemsize
+
+
+def _working_bytes(robust=False):
+    """
+    Number of bytes needed per frame per pixel for working arrays, depending
+    on whether `robust` statistics are calculated.
+    """
+    return _bytes_per_value_robust if robust else _bytes_per_value_float
+
+
+def choose_mode(nr_frames, image_shape, memory_budget=default_memory_budget, itemsize=2, robust=False):
+    """
+    Choose a stacking mode for `nr_frames` images of shape `image_shape`
+    with a maximum memory usage of `memory_budget` (in MB). Set `robust` if
+    robust statistics will also be calculated.
+
+    If the full (N, H, W) cube fits into the budget, with room for working
+    arrays, "memory" is returned. Otherwise, "tiled" (out-of-core) is returned.
+    """
+    required = _cube_size(nr_frames, image_shape, itemsize + _working_bytes(robust))
+    mode = "memory" if required <= memory_budget * 1024**2 else "tiled"
+    return mode
+
+
+def choose_tile_rows(nr_frames, image_shape, memory_budget=default_memory_budget, itemsize=2, workers=1, robust=False):
+    """
+    Choose the number of image rows per tile, such that `workers` tiles of
+    `nr_frames` images of shape `image_shape` can be processed simultaneously
+    within a memory budget of `memory_budget` (in MB). Set `robust` if
+    robust statistics will also be calculated.
+    At least one row is always used.
+    """
+    bytes_per_row = _cube_size(nr_frames, image_shape[1:], itemsize + _working_bytes(robust))
+    budget_per_worker = memory_budget * 1024**2 / max(workers, 1)
+    rows = int(budget_per_worker // bytes_per_row)
+    rows = min(max(rows, 1), image_shape[0])
+    return rows
+
+
+def _read_tile(source, rows):
+    """
+    Read the image rows `rows` from all frames in `source`.
+
+    `source` is either an (N, H, W) array or a list of N (H, W) arrays, such
+    as memory-mapped per-frame files. In the latter case, only the pixels in
+    `rows` are read from each frame.
+    """
+    if isinstance(source, np.ndarray):
+        # The tile is a view into the full cube
+        tile = source[:, rows]
+    else:
+        # Read only the tile's pixels from each frame
+        tile = np.stack([frame[rows] for frame in source])
+
+    return tile
+
+
+def sigma_clipped_mean_std(data, sigma=default_clip_sigma, iterations=default_clip_iterations):
+    """
+    Calculate the sigma-clipped mean and standard deviation along the first
+    axis of `data`, for example per pixel in an (N, H, W) stack.
+    In each of at most `iterations` iterations, values that deviate from the
+    mean by more than `sigma` standard deviations are removed, and the mean
+    and standard deviation are re-calculated. Stops early if no more values
+    are removed. Calculations are done in float32.
+    """
+    # Work on a float32 copy, so clipped values can be set to NaN
+    data = data.astype(np.float32)
+    mean = np.nanmean(data, axis=0)
+    stds = np.nanstd(data, axis=0)
+
+    for i in range(iterations):
+        # Find values outside the clipping range
+        outliers = np.abs(data - mean) > sigma * stds
+        if not outliers.any():
+            break
+
+        # Remove them and re-calculate the mean and standard deviation
+        data[outliers] = np.nan
+        del outliers
+        mean = np.nanmean(data, axis=0)
+        stds = np.nanstd(data, axis=0)
+
+    return mean, stds
+
+
+def _stack_tile(source, rows, outputs, robust=False, sigma=default_clip_sigma, iterations=default_clip_iterations):
+    """
+    Calculate the mean and standard deviation per pixel in the image rows
+    `rows` of `source` and write them into the first two arrays in `outputs`.
+    If `robust`, also calculate the median and sigma-clipped mean and standard
+    deviation, and write them into the other three arrays in `outputs`.
+    """
+    tile = _read_tile(source, rows)
+
+    outputs[0][rows] = tile.mean(axis=0, dtype=np.float32)
+    outputs[1][rows] = tile.std(axis=0, dtype=np.float32)
+
+    if robust:
+        outputs[2][rows] = np.median(tile, axis=0)
+        outputs[3][rows], outputs[4][rows] = sigma_clipped_mean_std(tile, sigma=sigma, iterations=iterations)
+
+
+def _cache_frame(filename, frame):
+    """
+    Save an image `frame` to the per-frame cache file `filename` and return a
+    read-only memory map of it. If `frame` is already a memory map, e.g. from
+    the persistent frame cache (see `io.enable_frame_cache`), it is returned
+    as-is.
+    Helper function for `stack`.
+    """
+    if isinstance(frame, np.memmap):
+        return frame
+
+    np.save(filename, frame)
+    return np.load(filename, mmap_mode="r")
+
+
+def _load_and_cache_frame(filename, load_function, file):
+    """
+    Load the image in `file` using `load_function` and save it to the
+    per-frame cache file `filename`, see `_cache_frame`.
+    Helper function for `stack`.
+    """
+    return _cache_frame(filename, load_function(file))
+
+
+def _stack_tiles(source, nr_frames, image_shape, dtype, memory_budget, workers, **kwargs):
+    """
+    Calculate the statistics per pixel of `source`, one tile (block of rows)
+    at a time, processing `workers` tiles in parallel. Any additional
+    **kwargs are passed to `_stack_tile`.
+    Helper function for `stack`.
+    """
+    robust = kwargs.get("robust", False)
+    itemsize = np.dtype(dtype).itemsize
+    tile_rows = choose_tile_rows(nr_frames, image_shape, memory_budget=memory_budget, itemsize=itemsize, workers=workers, robust=robust)
+    tiles = [np.s_[start:start+tile_rows] for start in range(0, image_shape[0], tile_rows)]
+
+    # Create the output arrays
+    nr_outputs = 5 if robust else 2
+    outputs = [np.empty(image_shape, dtype=np.float32) for i in range(nr_outputs)]
+
+    # Process the tiles in parallel; NumPy releases the GIL in the reductions
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_stack_tile, source, rows, outputs, **kwargs) for rows in tiles]
+        # Raise any errors that occurred in the threads
+        for future in futures:
+            future.result()
+
+    return outputs
+
+
+def stack(files, load_function=io.load_raw_image, image_shape=None, mode="auto", memory_budget=default_memory_budget, workers=None, cache_folder=None, robust=False, sigma=default_clip_sigma, iterations=default_clip_iterations):
+    """
+    Calculate the mean and standard deviation per pixel over all images in
+    `files`, loaded using `load_function` (default: `io.load_raw_image`).
+    The results are returned as float32 arrays.
+
+    If `robust` is True, also calculate robust statistics per pixel, namely
+    the median and the sigma-clipped mean and standard deviation (see
+    `sigma_clipped_mean_std`, which `sigma` and `iterations` are passed to).
+    These are returned after the mean and standard deviation, in that order.
+    Robust statistics are not available in "streaming" mode.
+
+    The stacking `mode` can be:
+        * "memory": load all images into a single (N, H, W) array, then
+        process it in tiles (blocks of rows) in parallel.
+        * "tiled": decode each image once into a per-frame cache of
+        memory-mapped NPY files in `cache_folder` (default: a temporary
+        folder), then read and process one tile of all images at a time, in
+        parallel. If the persistent frame cache is enabled (see
+        `io.enable_frame_cache`), RAW images are memory-mapped from there
+        instead. The memory usage is set by `memory_budget` rather than by
+        the number of images.
+        * "streaming": load one image at a time, decoding the next ones in
+        parallel, and update the mean and standard deviation on the fly (see
+        `stack_streaming`).
+        * "auto" (default): choose between "memory" and "tiled" based on the
+        number of images, the image shape `image_shape` (e.g.
+        `Camera.image_shape`; if None, the shape of the first image is used),
+        and the `memory_budget` (in MB).
+
+    `workers` is the number of parallel workers used for decoding and tile
+    processing (default: None, as many as there are CPUs).
+    """
+    # Make sure there is something to stack
+    assert len(files) > 0, "No files given to stack."
+
+    # Determine the number of workers to use
+    if workers is None:
+        workers = os.cpu_count()
+
+    # Streaming does not use tiles, so handle it separately
+    if mode == "streaming":
+        if robust:
+            raise ValueError("Robust statistics cannot be calculated in streaming mode.")
+        return stack_mean_std(files, load_function=load_function, workers=workers)
+
+    # Load the first file to get the shape and data type of the images
+    frame0 = load_function(files[0])
+    if image_shape is None:
+        image_shape = frame0.shape
+
+    # Choose the stacking mode
+    if mode == "auto":
+        mode = choose_mode(len(files), image_shape, memory_budget=memory_budget, itemsize=frame0.itemsize, robust=robust)
+
+    # Arguments for the statistics calculated per tile
+    tile_kwargs = {"robust": robust, "sigma": sigma, "iterations": iterations}
+
+    if mode == "memory":
+        # Load all images into a single array
+        del frame0
+        source = io.load_multi(files, load_function, workers=workers)
+        results = _stack_tiles(source, len(files), source.shape[1:], source.dtype, memory_budget, workers, **tile_kwargs)
+
+    elif mode == "tiled":
+        with TemporaryDirectory(dir=cache_folder) as cache:
+            cache = Path(cache)
+
+            # Decode each image once and save it to the per-frame cache
+            # The cached images are opened as memory maps
+            source = [_cache_frame(cache/"0.npy", frame0)]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_load_and_cache_frame, cache/f"{j}.npy", load_function, file) for j, file in enumerate(files[1:], 1)]
+                source += [future.result() for future in futures]
+
+            # Stack the cached images tile by tile
+            results = _stack_tiles(source, len(files), frame0.shape, frame0.dtype, memory_budget, workers, **tile_kwargs)
+            del source
+
+    else:
+        raise ValueError(f"Unknown stacking mode `{mode}`.")
+
+    return tuple(results)
+
+
+def _file_record(file):
+    """
+    Describe a `file` by its absolute path, size, and modification time.
+    """
+    file = Path(file).absolute()
+    stat = file.stat()
+    return {"path": str(file), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+def manifest_filename(goal):
+    """
+    Filename of the manifest for the stacks saved at `goal`, e.g.
+    `level1/level2/level3_manifest.json` for `level1/level2/level3`.
+    """
+    return Path(f"{goal}_manifest.json")
+
+
+def write_manifest(goal, files, outputs):
+    """
+    Write a manifest for the stacks saved at `goal`, listing the input
+    `files` (path, size, and modification time) and the `outputs` filenames.
+    The manifest is written to a temporary file first and then renamed, so an
+    interrupted run never leaves an incomplete manifest.
+    """
+    manifest = {"inputs": sorted((_file_record(file) for file in files), key=lambda record: record["path"]),
+                "outputs": [str(Path(output).absolute()) for output in outputs]}
+
+    filename = manifest_filename(goal)
+    temporary_filename = filename.with_suffix(".json.tmp")
+    io.write_json(manifest, temporary_filename)
+    os.replace(temporary_filename, filename)
+
+
+def is_up_to_date(goal, files, outputs):
+    """
+    Check if the stacks saved at `goal` are up to date, meaning that a
+    manifest exists for them, that the input `files` are the same as when
+    the manifest was written (path, size, and modification time), and that
+    all `outputs` exist.
+    """
+    try:
+        manifest = io.load_json(manifest_filename(goal))
+    except (FileNotFoundError, ValueError):
+        return False
+
+    records = sorted((_file_record(file) for file in files), key=lambda record: record["path"])
+    outputs_exist = all(Path(output).exists() for output in outputs)
+    outputs_listed = sorted(str(Path(output).absolute()) for output in outputs) == sorted(manifest.get("outputs", []))
+
+    return outputs_exist and outputs_listed and records == manifest.get("inputs")
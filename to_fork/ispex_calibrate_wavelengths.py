@@ -27,7 +27,7 @@ camera = io.load_camera(root)
 print(f"Loaded Camera object: {camera}")
 
 # Load the data
-img = io.load_raw_file(file)
+img = io.load_raw_data(file, colors=True)
 print("Loaded data")
 
 # Bias correction
@@ -7,14 +7,26 @@ The subfolders are created in the same folder as the data, and labelled using
 the system time and an increasing number. This ensures the subfolders are
 in the same order as the original data.
 
+Alternatively, the files can be split according to their capture settings
+(ISO speed and exposure time), read from their EXIF data. In this case, the
+subfolders are labelled with these settings, in the format used by
+`io.split_iso` and `io.split_exposure_time`: e.g. `iso100` for ISO speed 100
+if all files have the same exposure time, `1_250` for an exposure time of
+1/250 seconds if all files have the same ISO speed, or `iso100/1_250` if both
+vary. Files without an ISO speed or exposure time in their EXIF data are not
+moved. The EXIF data are stored in an index file in `folder_main`, so they are
+only read once.
+
 Command line arguments:
     * `folder_main`: folder containing RAW (and JPEG, if available) files which
     should be split into subfolders.
-    * `blocksize`: the number of files to put in each folder (e.g. 10, 15).
+    * `blocksize`: the number of files to put in each folder (e.g. 10, 15), or
+    `exif` to split the files according to their capture settings.
 """
 
 from sys import argv
 from shutil import move
+from fractions import Fraction
 import os
 from time import time
 from spectacle import io
@@ -28,16 +40,49 @@ print(f"Loaded Camera object: {camera}")
 
 raw_pattern = f"*{camera.raw_extension}"
 
-blocksize = int(argv[2])
 files = list(folder_main.glob(raw_pattern))
 files = sorted(files)
-blocks = len(files) // blocksize
-for i in range(blocks):
-    foldername = str(int(time()*10000)) + str(i%10)
+
+if argv[2] == "exif":
+    # Group the files by their capture settings, from the EXIF index
+    exif_index = io.load_exif_index(folder_main, pattern=raw_pattern)
+    settings = {}
+    for file in files:
+        exif = exif_index[file.name]
+        if exif["iso"] is None or exif["exposure_time"] is None:
+            print(f"No ISO speed or exposure time in the EXIF data of `{file}`, skipping it.")
+            continue
+        settings.setdefault((exif["iso"], exif["exposure_time"]), []).append(file)
+
+    # Label each group with its ISO speed and/or exposure time, whichever vary
+    # Exposure times are written as exact fractions, e.g. `1_3` or `3_10`
+    iso_varies = len({iso for iso, exposure_time in settings}) > 1
+    exposure_varies = len({exposure_time for iso, exposure_time in settings}) > 1
+    blocks = []
+    for (iso, exposure_time), files_block in settings.items():
+        fraction = Fraction(exposure_time).limit_denominator(1000000)
+        exposure_label = str(fraction.numerator) if fraction.denominator == 1 else f"{fraction.numerator}_{fraction.denominator}"
+        iso_label = f"iso{iso}"
+        if iso_varies and exposure_varies:
+            label = f"{iso_label}/{exposure_label}"
+        elif exposure_varies:
+            label = exposure_label
+        else:
+            label = iso_label
+        blocks.append((label, files_block))
+
+else:
+    # Split the files into blocks of `blocksize` files each, in order
+    # These are labelled with the system time when they are created
+    blocksize = int(argv[2])
+    blocks = [(None, files[blocksize*i : blocksize*(i+1)]) for i in range(len(files) // blocksize)]
+
+for i, (foldername, files_block) in enumerate(blocks):
+    if foldername is None:
+        foldername = str(int(time()*10000)) + str(i%10)
     total_path = folder_main/foldername
     print(total_path)
-    os.mkdir(total_path)
-    files_block = files[blocksize*i : blocksize*(i+1)]
+    os.makedirs(total_path)
     for file in files_block:
         move(str(file), total_path)
         withjpg = io.replace_suffix(file, ".jpg")
@@ -10,27 +10,89 @@ Images are assumed to be in the `images` subfolder (see `data_template`).
 By default, the save folder is the same as the data folder, but with `images`
 replaced with `stacks`.
 
-For particularly large data sets, use the `stack_heavy.py` script instead.
+A manifest listing the input files (path, size, and modification time) is
+saved next to each set of stacks. Folders whose input files have not changed
+since their stacks were made are skipped, so an interrupted run resumes after
+the last completed folder and adding a new folder only stacks that folder.
+
+Stacks are calculated using `spectacle.stacking.stack`. If the images of a
+folder fit into the memory budget, they are loaded at once; otherwise, each
+image is decoded into a temporary per-frame cache and the stack is calculated
+in tiles. Either way, tiles are processed in parallel. If a camera
+information file is available in the root folder, the image shape and RAW
+file extension are taken from it.
+
+JPEG images are stacked one at a time while the next ones are decoded in
+parallel, accumulating exact integer sums. In "streaming" mode, RAW and JPEG
+images with the same name are stacked together in a single pass.
 
 Command line arguments:
     * `folder`: folder containing data. Any RAW (and optionally JPEG) images in
     this folder and any of its subfolders will be stacked, as described above.
 
+Command line options:
+    * `-m`, `--memory`: memory budget in MB (default: 2048).
+    * `-w`, `--workers`: number of parallel workers (default: number of CPUs).
+    * `--mode`: stacking mode, one of "auto" (default), "memory", "tiled", or
+    "streaming". See `spectacle.stacking.stack` for details.
+    * `--cache`: folder for the temporary per-frame cache used in tiled mode
+    (default: the system temporary folder).
+    * `--frame-cache`: enable the persistent cache of decoded RAW images, so
+    that re-stacking the same files does not decode them again (see
+    `spectacle.io.enable_frame_cache`).
+    * `--frame-cache-size`: maximum size of the persistent cache in MB
+    (default: 10240).
+    * `-f`, `--force`: re-stack all folders, even if they are up to date.
+    * `-r`, `--robust`: also calculate robust statistics per pixel for the RAW
+    images, namely the median (saved as `level3_median.npy`) and the
+    sigma-clipped mean and standard deviation (`level3_clipmean.npy` and
+    `level3_clipstds.npy`). Not available in "streaming" mode.
+
 TO DO:
     * Allow input/output folders that are not in `images` or `stacks`
 """
 
 import numpy as np
-from sys import argv
-from spectacle import io
+from optparse import OptionParser
+from spectacle import io, stacking
 from os import walk, makedirs
 
-# Get the data folder from the command line
-folder = io.path_from_input(argv)
+# Get the data folder and options from the command line
+parser = OptionParser(usage="%prog folder [options]")
+parser.add_option("-m", "--memory", dest="memory", type="float", default=stacking.default_memory_budget, help="Memory budget in MB")
+parser.add_option("-w", "--workers", dest="workers", type="int", default=None, help="Number of parallel workers")
+parser.add_option("--mode", dest="mode", default="auto", choices=["auto", "memory", "tiled", "streaming"], help="Stacking mode")
+parser.add_option("--cache", dest="cache", default=None, help="Folder for the temporary per-frame cache")
+parser.add_option("--frame-cache", dest="frame_cache", action="store_true", default=False, help="Use the persistent cache of decoded RAW images")
+parser.add_option("--frame-cache-size", dest="frame_cache_size", type="float", default=10240, help="Maximum size of the persistent cache in MB")
+parser.add_option("-f", "--force", dest="force", action="store_true", default=False, help="Re-stack folders even if they are up to date")
+parser.add_option("-r", "--robust", dest="robust", action="store_true", default=False, help="Also calculate the median and sigma-clipped mean/std")
+options, args = parser.parse_args()
+if options.robust and options.mode == "streaming":
+    parser.error("Robust statistics (-r/--robust) are not available in streaming mode.")
+folder = io.Path(args[0])
+
+# Enable the persistent cache of decoded RAW images if desired
+if options.frame_cache:
+    frame_cache = io.enable_frame_cache(max_size=options.frame_cache_size)
+    print(f"Using {frame_cache}")
+
+# Load Camera object, if available
+try:
+    root = io.find_root_folder(folder)
+except OSError:
+    camera = None
+    image_shape = None
+    print("No camera information found, determining image properties from data.")
+else:
+    camera = io.load_camera(root)
+    image_shape = camera.image_shape
+    print(f"Loaded Camera object: {camera}")
 
 # Common RAW file extensions - try all, then select the one that works
+# If a Camera object is available, use its RAW file extension
 raw_patterns = ["*.dng", "*.NEF", "*.CR2"]
-raw_pattern = None
+raw_pattern = None if camera is None else f"*{camera.raw_extension}"
 
 # Walk through the folder and all its subfolders
 for tup in walk(folder):
@@ -57,40 +119,63 @@ for tup in walk(folder):
         # If there are no RAW files in this folder, move on to the next
         continue
 
+    # Find all JPEG files in this folder
+    JPGs = list(folder_here.glob("*.jp*g"))
+
+    # The files that will be created for this folder
+    outputs = [f"{goal}_mean.npy", f"{goal}_stds.npy"]
+    if len(JPGs) > 0:
+        outputs += [f"{goal}_jmean.npy", f"{goal}_jstds.npy"]
+    if options.robust:
+        outputs += [f"{goal}_median.npy", f"{goal}_clipmean.npy", f"{goal}_clipstds.npy"]
+
+    # If the stacks for this folder are up to date, move on to the next
+    if not options.force and stacking.is_up_to_date(goal, raw_files + JPGs, outputs):
+        print(f"{folder_here}  -->  {goal}_x.npy (up to date, skipped)")
+        continue
+
     # Create the goal folder if it does not exist yet
     makedirs(goal.parent, exist_ok=True)
 
-    # Load all RAW files
-    arrs = io.load_raw_image_multi(folder_here, pattern=raw_pattern)
-
-    # Calculate and save the mean per pixel
-    mean = arrs.mean(axis=0, dtype=np.float32)
+    # In streaming mode, stack RAW and JPEG images in a single pass if every
+    # RAW file has a corresponding JPEG file
+    pairs = stacking.pair_files(raw_files, JPGs) if options.mode == "streaming" and len(JPGs) > 0 else None
+    if pairs is not None:
+        (mean, stds), (jmean, jstds) = stacking.stack_streaming(*pairs, load_functions=[io.load_raw_image, io.load_jpg_image], workers=options.workers)
+
+    # Otherwise, calculate the mean and standard deviation per pixel of the
+    # RAW images separately
+    else:
+        results = stacking.stack(raw_files, load_function=io.load_raw_image, image_shape=image_shape, mode=options.mode, memory_budget=options.memory, workers=options.workers, cache_folder=options.cache, robust=options.robust)
+        mean, stds = results[:2]
+
+        # Save the robust statistics per pixel, if desired
+        if options.robust:
+            median, clipmean, clipstds = results[2:]
+            np.save(f"{goal}_median.npy", median)
+            np.save(f"{goal}_clipmean.npy", clipmean)
+            np.save(f"{goal}_clipstds.npy", clipstds)
+        del results
+
+    # Save the mean and standard deviation per pixel
     np.save(f"{goal}_mean.npy", mean)
-    del mean
-
-    # Calculate and save the standard deviation per pixel
-    stds = arrs.std(axis=0, dtype=np.float32)
     np.save(f"{goal}_stds.npy", stds)
-    del stds, arrs
+    del mean, stds
 
     # Print the input and output folder as confirmation
     print(f"{folder_here}  -->  {goal}_x.npy")
 
-    # Find all JPEG files in this folder
-    JPGs = list(folder_here.glob("*.jp*g"))
-    if len(JPGs) == 0:
-        # If there are no JPEG files in this folder, move on to the next
-        continue
-
-    # Load all JPEG files
-    jarrs = io.load_jpg_multi(folder_here)
+    # If there are JPEG files in this folder, stack them too
+    if len(JPGs) > 0:
+        # Calculate the mean and standard deviation per pixel, if this was
+        # not done together with the RAW images
+        if pairs is None:
+            jmean, jstds = stacking.stack_mean_std(JPGs, load_function=io.load_jpg_image, workers=options.workers)
 
-    # Calculate and save the mean per pixel
-    jmean = jarrs.mean(axis=0, dtype=np.float32)
-    np.save(f"{goal}_jmean.npy", jmean)
-    del jmean
+        # Save the mean and standard deviation per pixel
+        np.save(f"{goal}_jmean.npy", jmean)
+        np.save(f"{goal}_jstds.npy", jstds)
+        del jmean, jstds
 
-    # Calculate and save the standard deviation per pixel
-    jstds = jarrs.std(axis=0, dtype=np.float32)
-    np.save(f"{goal}_jstds.npy", jstds)
-    del jstds, jarrs
+    # Save the manifest, marking this folder as completed
+    stacking.write_manifest(goal, raw_files + JPGs, outputs)
@@ -0,0 +1,41 @@
+"""
+Combine the mean and standard deviation NPY stacks in a folder into a single
+series container file, which stores the stacks in spatial tiles together with
+the independent variable (ISO speed, exposure time, or polariser angle) that
+is otherwise parsed from the filenames. `io.load_means` and `io.load_stds`
+load series container files transparently, as long as the NPY stacks have
+not changed since; run this script again after re-stacking.
+
+The series file is saved in the same folder as the stacks, as
+`folder/<variable>.series`.
+
+Command line arguments:
+    * `folder`: folder containing `*_mean.npy` and `*_stds.npy` stacks.
+
+Command line options:
+    * `-v`, `--variable`: independent variable, one of "iso" (default),
+    "exposure", or "polariser".
+    * `-t`, `--tile`: size of the square spatial tiles in pixels (default: 256).
+"""
+
+from optparse import OptionParser
+from spectacle import io
+
+# Get the data folder and options from the command line
+parser = OptionParser(usage="%prog folder [options]")
+parser.add_option("-v", "--variable", dest="variable", default="iso", choices=list(io.series_retrieve_functions.keys()), help="Independent variable")
+parser.add_option("-t", "--tile", dest="tile", type="int", default=256, help="Tile size in pixels")
+options, args = parser.parse_args()
+folder = io.Path(args[0])
+
+# Load the stacks from the individual NPY files
+retrieve_value = io.series_retrieve_functions[options.variable]
+values, means = io.load_npy(folder, io.series_patterns["mean"], retrieve_value=retrieve_value)
+values_stds, stds = io.load_npy(folder, io.series_patterns["stds"], retrieve_value=retrieve_value)
+assert (values == values_stds).all(), "The mean and standard deviation stacks do not match."
+
+# Write the series container file, recording which NPY files it was made from
+saveto = folder/f"{options.variable}{io.series_extension}"
+sources = {name: list(folder.glob(pattern)) for name, pattern in io.series_patterns.items()}
+io.write_series(saveto, values, means, stds, variable=options.variable, tile_shape=(options.tile, options.tile), sources=sources)
+print(f"{folder}  -->  {saveto}")